@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the stderr parser, comparing parse_import_failure with the
+original three-pass parse_missing_module over synthetic stderr of various sizes.
+
+Usage: python bench_parse.py [--sizes 1 10 100 500] [--repeat 3] > bench_output.txt
+"""
+
+import argparse
+import re
+import time
+
+from dependency_guesser import parse_import_failure
+
+NOISE_LINE = "INFO worker-3 processed batch 18231 in 0.0042s (queue depth 17)\n"
+IMPORT_TRACEBACK = (
+    "Traceback (most recent call last):\n"
+    '  File "/srv/app/main.py", line 12, in <module>\n'
+    "    import yaml\n"
+    "ModuleNotFoundError: No module named 'yaml'\n"
+)
+OTHER_TRACEBACK = (
+    "Traceback (most recent call last):\n"
+    '  File "/srv/app/main.py", line 40, in <module>\n'
+    "    main()\n"
+    "ValueError: invalid literal for int() with base 10: 'x'\n"
+)
+
+
+def baseline_parse_missing_module(stderr_output):
+    """
+    The parser as it was before the combined pattern, kept for comparison.
+    """
+    patterns = [
+        r"No module named '([^']*)'",
+        r"No module named \"([^\"]*)\"",
+        r"ImportError: No module named (\S+)",
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, stderr_output)
+        if match:
+            return match.group(1)
+    return None
+
+
+def make_noise(size):
+    """
+    Returns roughly size bytes of log lines without any traceback in them.
+    """
+    return NOISE_LINE * (size // len(NOISE_LINE))
+
+
+def make_cases(size):
+    """
+    Returns the synthetic inputs of about size bytes, keyed by case name.
+    """
+    noise = make_noise(size)
+    return {
+        # A missing module ending the run
+        "import-traceback": noise + IMPORT_TRACEBACK,
+        # Nothing but log noise, so there is no header to start from
+        "no-header": noise,
+        # A handled import error early on, then an unrelated failure
+        "non-import-final": IMPORT_TRACEBACK + noise + OTHER_TRACEBACK,
+    }
+
+
+def best_time(function, argument, repeat):
+    """
+    Returns the fastest of repeat calls, in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="Input sizes in MB (default: 1 10 100).",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per measurement (default: 3)."
+    )
+    args = parser.parse_args()
+
+    print(f"{'case':<18} {'size':>7} {'parse_import_failure':>22} {'baseline':>12}")
+    for size in args.sizes:
+        for case, stderr_output in make_cases(size * 1024 * 1024).items():
+            current = best_time(parse_import_failure, stderr_output, args.repeat)
+            baseline = best_time(
+                baseline_parse_missing_module, stderr_output, args.repeat
+            )
+            print(f"{case:<18} {size:>5}MB {current:>20.3f}ms {baseline:>10.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,35 @@
 #!python3
 import argparse
+import ast
+import asyncio
+import base64
+import concurrent.futures
+import configparser
+import csv
+import functools
+import glob
+import hashlib
+import importlib.metadata
 import json
 import logging
 import os
 import re
+import shutil
+import site
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import weakref
+import zipfile
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
 
 # Define the standard name for the virtual environment directory
 VENV_NAME = "env"
@@ -19,204 +43,4016 @@ def get_local_dir() -> str:
     return os.path.dirname(os.path.abspath(__file__))
 
 
-def load_aliases() -> dict:
-    """
-    Loads the aliases from a JSON file located in the same directory as this script.
-    """
-    local_dir = get_local_dir()
-    aliases_file = os.path.join(local_dir, "aliases.json")
-    if not os.path.exists(aliases_file):
-        logging.warning(f"Aliases file not found: {aliases_file}")
-        return {}
+def load_aliases() -> dict:
+    """
+    Loads the aliases from a JSON file located in the same directory as this script.
+    """
+    local_dir = get_local_dir()
+    aliases_file = os.path.join(local_dir, "aliases.json")
+    if not os.path.exists(aliases_file):
+        logging.warning(f"Aliases file not found: {aliases_file}")
+        return {}
+
+    with open(aliases_file, "r") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            logging.error(f"Failed to parse aliases file: {e}")
+            return {}
+
+
+def get_cache_dir() -> str:
+    """
+    Returns the per-user directory where the resolver keeps its caches.
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "dependency_guesser")
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """
+    Writes data as JSON through a per-process temp file, so concurrent readers
+    and writers only ever see complete files. Raises OSError on failure.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + f".{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, **dump_kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def get_pip_wheel_cache_dir() -> str:
+    """
+    Returns the directory where pip keeps the wheels it has built locally.
+    """
+    if os.environ.get("PIP_CACHE_DIR"):
+        base = os.environ["PIP_CACHE_DIR"]
+    elif sys.platform == "win32":
+        base = os.path.join(os.environ.get("LOCALAPPDATA", ""), "pip", "Cache")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches/pip")
+    else:
+        base = os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "pip"
+        )
+    return os.path.join(base, "wheels")
+
+
+def get_environment_path(python_executable) -> str:
+    """
+    Returns the root of the environment the given interpreter belongs to.
+    Venv interpreters are usually symlinks to the base interpreter, so the path
+    is not resolved further.
+    """
+    executable = os.path.abspath(shutil.which(python_executable) or python_executable)
+    bin_dir = os.path.dirname(executable)
+    if os.path.basename(bin_dir) in ("bin", "Scripts"):
+        return os.path.dirname(bin_dir)
+    return bin_dir
+
+
+# Lock waits at least this long (in seconds) are logged at INFO level
+LOCK_WAIT_LOG_THRESHOLD = 0.1
+LOCK_POLL_INTERVAL = 0.05
+
+
+class EnvironmentLock:
+    """
+    Advisory file lock on an environment, shared by every resolver process on
+    the host. Probing takes a shared lock and changing the environment takes an
+    exclusive one. Windows has no shared file locks, so all locks are exclusive
+    there. Works with both 'with' and 'async with'.
+    """
+
+    def __init__(self, environment_path, exclusive=False):
+        self.environment_path = os.path.abspath(environment_path)
+        self.exclusive = exclusive
+        self.file = None
+
+    def acquire(self, blocking=True):
+        """
+        Takes the lock. Without blocking, returns False instead of waiting when
+        the lock is held elsewhere. If no lock file can be created, the caller
+        carries on unlocked rather than failing the run.
+        """
+        lock_dir = os.path.join(get_cache_dir(), "locks")
+        digest = hashlib.sha256(self.environment_path.encode()).hexdigest()[:16]
+        try:
+            os.makedirs(lock_dir, exist_ok=True)
+            self.file = open(os.path.join(lock_dir, f"{digest}.lock"), "a+b")
+        except OSError as e:
+            logging.warning(
+                f"Could not lock '{self.environment_path}', continuing without: {e}"
+            )
+            return True
+        start = time.monotonic()
+        try:
+            if sys.platform == "win32":
+                while True:
+                    try:
+                        self.file.seek(0)
+                        msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise BlockingIOError()
+                        time.sleep(LOCK_POLL_INTERVAL)
+            else:
+                operation = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+                if not blocking:
+                    operation |= fcntl.LOCK_NB
+                fcntl.flock(self.file, operation)
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            return False
+        except BaseException:
+            self.file.close()
+            self.file = None
+            raise
+
+        waited = time.monotonic() - start
+        mode = "exclusive" if self.exclusive else "shared"
+        message = (
+            f"Waited {waited:.2f}s for the {mode} lock on '{self.environment_path}'."
+        )
+        if waited >= LOCK_WAIT_LOG_THRESHOLD:
+            logging.info(message)
+        else:
+            logging.debug(message)
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+        if sys.platform == "win32":
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        # Waiting for the lock must not block the event loop
+        await asyncio.to_thread(self.acquire)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+def lock_environment(python_executable, exclusive=False):
+    """
+    Returns the EnvironmentLock of the environment the given interpreter belongs to.
+    """
+    return EnvironmentLock(get_environment_path(python_executable), exclusive)
+
+
+def normalize_distribution_name(name) -> str:
+    """
+    Normalizes a distribution name as described in PEP 503.
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_top_level_modules(top_level_text, record_text):
+    """
+    Returns the top-level modules a distribution provides, preferring its
+    top_level.txt and falling back to the paths listed in its RECORD.
+    """
+    if top_level_text:
+        return sorted(
+            {line.strip().split("/")[0] for line in top_level_text.splitlines()} - {""}
+        )
+
+    modules = set()
+    for line in (record_text or "").splitlines():
+        path = line.split(",")[0]
+        head, _, rest = path.partition("/")
+        if head.endswith((".dist-info", ".data")) or head in ("..", "__pycache__"):
+            continue
+        if rest:
+            modules.add(head)
+        elif head.endswith(".py"):
+            modules.add(head[:-3])
+        elif head.endswith((".so", ".pyd")):
+            modules.add(head.split(".")[0])
+    return sorted(modules)
+
+
+def parse_namespace_modules(record_text):
+    """
+    Returns the dotted names of the packages a distribution contributes to
+    namespace packages, such as 'google.cloud.storage', from the paths in its
+    RECORD. Directories without an __init__.py are namespace levels, as are the
+    well-known NAMESPACE_PACKAGES even when they ship a pkgutil-style
+    __init__.py; the first regular package (or module) below them is what
+    identifies the distribution.
+    """
+    paths = []
+    for line in (record_text or "").splitlines():
+        path = line.split(",")[0]
+        head = path.partition("/")[0]
+        if head.endswith((".dist-info", ".data")) or head in ("..", "__pycache__"):
+            continue
+        paths.append(path)
+    files = set(paths)
+
+    modules = set()
+    for path in paths:
+        parts = path.split("/")
+        for depth in range(1, len(parts)):
+            if ".".join(parts[:depth]) in NAMESPACE_PACKAGES:
+                continue
+            if "/".join(parts[:depth]) + "/__init__.py" in files:
+                if depth > 1:
+                    modules.add(".".join(parts[:depth]))
+                break
+        else:
+            if (
+                len(parts) > 1
+                and parts[-1].endswith(".py")
+                and parts[-1] != "__init__.py"
+            ):
+                modules.add(".".join(parts[:-1] + [parts[-1][:-3]]))
+    return sorted(modules)
+
+
+def read_text_or_none(path):
+    """
+    Reads a text file, returning None if it does not exist or cannot be read.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def scan_dist_info(dist_info_path):
+    """
+    Reads an installed distribution's name, top-level modules and namespace
+    package contributions from its .dist-info (or .egg-info) directory.
+    """
+    metadata = read_text_or_none(os.path.join(dist_info_path, "METADATA"))
+    metadata = metadata or read_text_or_none(os.path.join(dist_info_path, "PKG-INFO"))
+    match = re.search(r"^Name:\s*(\S+)", metadata or "", re.M)
+    name = match.group(1) if match else os.path.basename(dist_info_path).split("-")[0]
+    record_text = read_text_or_none(os.path.join(dist_info_path, "RECORD"))
+    modules = parse_top_level_modules(
+        read_text_or_none(os.path.join(dist_info_path, "top_level.txt")), record_text
+    )
+    return name, modules + parse_namespace_modules(record_text)
+
+
+def scan_wheel(wheel_path):
+    """
+    Reads a wheel's distribution name, top-level modules and namespace package
+    contributions without unpacking it.
+    """
+    name = os.path.basename(wheel_path).split("-")[0]
+    with zipfile.ZipFile(wheel_path) as wheel:
+        texts = {}
+        for member in wheel.namelist():
+            directory, _, filename = member.rpartition("/")
+            if directory.endswith(".dist-info") and "/" not in directory:
+                if filename in ("top_level.txt", "RECORD"):
+                    texts[filename] = wheel.read(member).decode("utf-8", "replace")
+    modules = parse_top_level_modules(texts.get("top_level.txt"), texts.get("RECORD"))
+    return name, modules + parse_namespace_modules(texts.get("RECORD"))
+
+
+def find_metadata_sources():
+    """
+    Lists every installed distribution and cached wheel this machine knows
+    about, mapped to its modification time.
+    """
+    site_dirs = set(site.getsitepackages())
+    if site.ENABLE_USER_SITE:
+        site_dirs.add(site.getusersitepackages())
+    site_dirs.update(
+        p for p in sys.path if p.endswith(("site-packages", "dist-packages"))
+    )
+
+    sources = {}
+    for site_dir in site_dirs:
+        try:
+            entries = os.scandir(site_dir)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.endswith((".dist-info", ".egg-info")) and entry.is_dir():
+                    sources[entry.path] = entry.stat().st_mtime
+    for root, _, files in os.walk(get_pip_wheel_cache_dir()):
+        for filename in files:
+            if filename.endswith(".whl"):
+                path = os.path.join(root, filename)
+                sources[path] = os.stat(path).st_mtime
+    return sources
+
+
+# Bumped whenever the modules recorded per distribution change
+MODULE_INDEX_VERSION = 3
+
+
+def build_module_index(index_path):
+    """
+    Builds (or incrementally refreshes) the on-disk module index and returns
+    the parsed index. Only distributions whose metadata changed since the last
+    build are read again.
+    """
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        index = {}
+    # Entries of an older format lack information and are read again
+    cached = (
+        index.get("sources", {}) if index.get("version") == MODULE_INDEX_VERSION else {}
+    )
+
+    sources = {}
+    changed = False
+    for path, mtime in find_metadata_sources().items():
+        entry = cached.get(path)
+        if entry is None or entry["mtime"] != mtime:
+            try:
+                if path.endswith(".whl"):
+                    name, modules = scan_wheel(path)
+                else:
+                    name, modules = scan_dist_info(path)
+            except (OSError, zipfile.BadZipFile) as e:
+                logging.debug(
+                    f"Skipping unreadable distribution metadata '{path}': {e}"
+                )
+                continue
+            entry = {"mtime": mtime, "name": name, "modules": modules}
+            changed = True
+        sources[path] = entry
+
+    index = {"version": MODULE_INDEX_VERSION, "sources": sources}
+    if changed or len(sources) != len(cached):
+        try:
+            write_json_atomic(index_path, index, separators=(",", ":"))
+        except OSError as e:
+            logging.warning(f"Could not save module index: {e}")
+    return index
+
+
+@functools.lru_cache(maxsize=None)
+def load_module_index() -> dict:
+    """
+    Returns a mapping of import names to the distribution that provides them.
+    It merges the optional module_index.json snapshot shipped next to this
+    script with an index of every distribution found on this machine. Modules
+    provided by several distributions (namespace packages) are left out, as
+    their name alone does not identify what to install.
+    """
+    snapshot_file = os.path.join(get_local_dir(), "module_index.json")
+    snapshot = {}
+    if os.path.exists(snapshot_file):
+        with open(snapshot_file, "r") as f:
+            try:
+                snapshot = json.load(f)
+            except json.JSONDecodeError as e:
+                logging.error(f"Failed to parse module index snapshot: {e}")
+
+    providers = {}
+    index_path = os.path.join(get_cache_dir(), "module_index.json")
+    for entry in build_module_index(index_path)["sources"].values():
+        for module in entry["modules"]:
+            providers.setdefault(module, set()).add(
+                normalize_distribution_name(entry["name"])
+            )
+
+    module_index = dict(snapshot)
+    for module, distributions in providers.items():
+        if len(distributions) == 1:
+            module_index[module] = distributions.pop()
+    return module_index
+
+
+# What the resolver should do about a classified failure
+INSTALL_MODULE = "install-module"
+UPGRADE_MODULE = "upgrade-module"
+INSTALL_DISTRIBUTION = "install-distribution"
+UPGRADE_DISTRIBUTION = "upgrade-distribution"
+ACTIONS = (INSTALL_MODULE, UPGRADE_MODULE, INSTALL_DISTRIBUTION, UPGRADE_DISTRIBUTION)
+
+# Entry point group third parties can use to contribute classifiers. Each entry
+# point must reference an ErrorClassifier, a (name, pattern, action) tuple, or an
+# iterable of either.
+CLASSIFIER_ENTRY_POINT_GROUP = "dependency_guesser.classifiers"
+
+TRACEBACK_HEADER = "Traceback (most recent call last)"
+# Lines joining a traceback to the one it was raised from
+CHAINED_TRACEBACK_MESSAGES = (
+    "During handling of the above exception, another exception occurred:",
+    "The above exception was the direct cause of the following exception:",
+)
+# Characters before a traceback header searched for one of those lines
+CHAINED_LOOKBACK = 1024
+FRAME_PATTERN = re.compile(r'File "(?P<filename>[^"]+)", line (?P<lineno>\d+)')
+# Exception name starting the line a classified message is reported on
+EXC_TYPE_PATTERN = re.compile(
+    r"[ \t]*(?P<exc_type>[A-Za-z_][\w.]*(?:Error|Exception|NotFound|Conflict)): "
+)
+
+
+@dataclass(frozen=True)
+class ErrorClassifier:
+    """
+    Recognizes one kind of import failure in stderr.
+    The pattern must capture the module or requirement to act on in a group
+    named 'target'; it is matched in multiline mode. The trigger is literal text
+    every match contains, letting stderr without it skip the pattern entirely.
+    """
+
+    name: str
+    pattern: str
+    action: str
+    trigger: Optional[str] = None
+
+
+CLASSIFIERS = [
+    ErrorClassifier(
+        "module-not-found",
+        r"No module named ['\"](?P<target>[^'\"]+)['\"]",
+        INSTALL_MODULE,
+        "No module named",
+    ),
+    # Python 2 style message with an unquoted module name
+    ErrorClassifier(
+        "module-not-found-unquoted",
+        r"No module named (?P<target>[A-Za-z_][\w.]*)$",
+        INSTALL_MODULE,
+        "No module named",
+    ),
+    # Only names missing from installed packages point at an outdated version;
+    # local modules and circular imports are the script's own problem
+    ErrorClassifier(
+        "cannot-import-name",
+        r"cannot import name '[^']+' from '(?P<target>[^']+)' "
+        r"\([^)]*(?:site|dist)-packages[^)]*\)",
+        UPGRADE_MODULE,
+        "cannot import name",
+    ),
+    ErrorClassifier(
+        "distribution-not-found",
+        r"DistributionNotFound: The '(?P<target>[^']+)' distribution was not found",
+        INSTALL_DISTRIBUTION,
+        "DistributionNotFound",
+    ),
+    ErrorClassifier(
+        "package-metadata-not-found",
+        r"PackageNotFoundError: No package metadata was found for (?P<target>\S+)",
+        INSTALL_DISTRIBUTION,
+        "PackageNotFoundError",
+    ),
+    ErrorClassifier(
+        "version-conflict",
+        r"VersionConflict: \(.*Requirement\.parse\('(?P<target>[^']+)'\)",
+        UPGRADE_DISTRIBUTION,
+        "VersionConflict",
+    ),
+]
+plugins_loaded = False
+
+
+def iter_entry_points(group):
+    """
+    Returns the installed entry points of a group, on any supported Python version.
+    """
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=group)
+    return entry_points.get(group, [])
+
+
+def register_classifier(name, pattern, action, trigger=None):
+    """
+    Adds a classifier to the registry, so matching failures are resolved automatically.
+    Raises ValueError if the classifier is invalid or clashes with the ones
+    already registered, leaving the registry unchanged.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown classifier action '{action}' for '{name}'.")
+    if "(?P<target>" not in pattern:
+        raise ValueError(f"Classifier '{name}' must capture a 'target' group.")
+    CLASSIFIERS.append(ErrorClassifier(name, pattern, action, trigger))
+    get_classifier_automaton.cache_clear()
+    try:
+        get_classifier_automaton()
+    except re.error as e:
+        CLASSIFIERS.pop()
+        get_classifier_automaton.cache_clear()
+        raise ValueError(f"Classifier '{name}' has an invalid pattern: {e}") from e
+
+
+def load_classifier_plugins():
+    """
+    Registers the classifiers contributed through the entry point group.
+    A broken plugin is logged and skipped rather than aborting the run.
+    """
+    global plugins_loaded
+    if plugins_loaded:
+        return
+    plugins_loaded = True
+
+    for entry_point in iter_entry_points(CLASSIFIER_ENTRY_POINT_GROUP):
+        try:
+            contributed = entry_point.load()
+            if isinstance(contributed, (ErrorClassifier, tuple)):
+                contributed = [contributed]
+            for classifier in contributed:
+                if isinstance(classifier, ErrorClassifier):
+                    classifier = (
+                        classifier.name,
+                        classifier.pattern,
+                        classifier.action,
+                        classifier.trigger,
+                    )
+                register_classifier(*classifier)
+        except Exception as e:
+            logging.warning(f"Ignoring classifier plugin '{entry_point.name}': {e}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_classifier_automaton():
+    """
+    Compiles every registered classifier into one alternation, so stderr is
+    matched against all of them in a single pass. Each classifier's 'target'
+    group is renamed to 't<index>' to keep the group names unique; no group is
+    wrapped around the alternatives, as that would stop re from skipping
+    straight to their literal first characters.
+    """
+    alternatives = [
+        classifier.pattern.replace("(?P<target>", f"(?P<t{index}>")
+        for index, classifier in enumerate(CLASSIFIERS)
+    ]
+    return re.compile("|".join(alternatives), re.M)
+
+
+def has_failure_trigger(text):
+    """
+    Cheap substring test telling whether any classifier could match the text.
+    """
+    return any(
+        classifier.trigger is None or classifier.trigger in text
+        for classifier in CLASSIFIERS
+    )
+
+
+@dataclass
+class ImportFailure:
+    """
+    A classified import failure found in a script's stderr.
+    """
+
+    target: str
+    action: str = INSTALL_MODULE
+    classifier: Optional[str] = None
+    exc_type: Optional[str] = None
+    filename: Optional[str] = None
+    lineno: Optional[int] = None
+
+
+def find_import_failure(segment):
+    """
+    Returns the last classified import failure in a piece of stderr, or None.
+    """
+    load_classifier_plugins()
+    if not has_failure_trigger(segment):
+        return None
+    last_match = None
+    for last_match in get_classifier_automaton().finditer(segment):
+        pass
+    if last_match is None:
+        return None
+
+    index = next(
+        index
+        for index in range(len(CLASSIFIERS))
+        if last_match.group(f"t{index}") is not None
+    )
+    classifier = CLASSIFIERS[index]
+    result = ImportFailure(
+        last_match.group(f"t{index}"), classifier.action, classifier.name
+    )
+    # Only the line the message is on is searched, so the type costs no extra pass
+    line_start = segment.rfind("\n", 0, last_match.start()) + 1
+    exc_type = EXC_TYPE_PATTERN.match(segment, line_start, last_match.end())
+    if exc_type:
+        result.exc_type = exc_type.group("exc_type")
+    # The innermost frame outside the import machinery is the importing line
+    for frame in FRAME_PATTERN.finditer(segment, 0, last_match.start()):
+        if not frame.group("filename").startswith("<frozen"):
+            result.filename = frame.group("filename")
+            result.lineno = int(frame.group("lineno"))
+    return result
+
+
+def parse_import_failure(stderr_output):
+    """
+    Finds the classified import failure that ended the output, if any.
+    Only the final traceback counts, together with the ones it is chained to:
+    an import error the script handled and printed earlier is not what made it
+    fail. The output is scanned from the end, so the cost depends on the size
+    of the final traceback rather than on the whole log.
+    """
+    end = len(stderr_output)
+    while end > 0:
+        start = stderr_output.rfind(TRACEBACK_HEADER, 0, end)
+        # Messages printed outside a traceback are only found without one
+        failure = find_import_failure(stderr_output[max(start, 0) : end])
+        if failure or start == -1:
+            return failure
+        # Only the text just before the header can join it to an earlier one
+        preceding = stderr_output[max(start - CHAINED_LOOKBACK, 0) : start]
+        if not preceding.rstrip().endswith(CHAINED_TRACEBACK_MESSAGES):
+            return None
+        end = start
+    return None
+
+
+def parse_missing_module(stderr_output):
+    """
+    Parses stderr output to find the name of the missing module.
+    It looks for standard 'No module named' or 'ImportError' messages.
+    """
+    failure = parse_import_failure(stderr_output)
+    if failure and failure.action == INSTALL_MODULE:
+        return failure.target
+    return None
+
+
+# Exception names whose handlers mark the guarded imports as optional
+IMPORT_GUARD_EXCEPTIONS = {
+    "ImportError",
+    "ModuleNotFoundError",
+    "Exception",
+    "BaseException",
+}
+
+
+def is_import_guard(handler):
+    """
+    Returns True if an 'except' clause would swallow a failed import.
+    """
+    if handler.type is None:
+        return True
+    if isinstance(handler.type, ast.Tuple):
+        types = handler.type.elts
+    else:
+        types = [handler.type]
+    return any(
+        isinstance(t, ast.Name) and t.id in IMPORT_GUARD_EXCEPTIONS for t in types
+    )
+
+
+def collect_imports(nodes, module_names):
+    """
+    Walks the given AST nodes and adds every absolute imported module to module_names.
+    Imports inside a 'try' block guarded by an ImportError handler are optional
+    by design, so only the fallback branches of such blocks are collected.
+    """
+    for node in nodes:
+        if isinstance(node, ast.Try) and any(
+            is_import_guard(handler) for handler in node.handlers
+        ):
+            collect_imports(node.handlers + node.orelse + node.finalbody, module_names)
+            continue
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                module_names.add(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            # Relative imports ('from . import x') always refer to local code
+            if node.level == 0 and node.module:
+                module_names.add(node.module)
+        collect_imports(ast.iter_child_nodes(node), module_names)
+
+
+# Namespace packages shared by many distributions; a missing module below one
+# of them is never installed under the namespace's own name
+NAMESPACE_PACKAGES = {
+    "azure",
+    "azure.ai",
+    "azure.keyvault",
+    "azure.mgmt",
+    "azure.storage",
+    "backports",
+    "google",
+    "google.cloud",
+    "jaraco",
+    "sphinxcontrib",
+    "zope",
+}
+
+
+def scan_imports(script_path):
+    """
+    Statically parses a script and returns the set of top-level module names it imports.
+    Both module-level and nested (function, class, conditional) imports are included.
+    Imports below a namespace package keep their dotted name, since the namespace
+    itself does not identify a distribution.
+    """
+    with open(script_path, "rb") as f:
+        tree = ast.parse(f.read(), filename=script_path)
+
+    module_names = set()
+    collect_imports([tree], module_names)
+    # A bare namespace ('from google.cloud import x') is left to the run to resolve
+    return {
+        name if name.split(".")[0] in NAMESPACE_PACKAGES else name.split(".")[0]
+        for name in module_names
+        if name not in NAMESPACE_PACKAGES
+    }
+
+
+# Executed by the target interpreter: reads module names from stdin and prints
+# a JSON map of each name to a [status, detail] pair, where status is 'found'
+# (detail: origin), 'namespace', 'missing' or 'error' (detail: the exception).
+# Only find_spec is called, which imports the parents of dotted names but never
+# runs the modules themselves; anything they print goes to stderr.
+FIND_SPECS_CODE = """
+import importlib.util, json, sys
+request = json.load(sys.stdin)
+if not request["cwd"]:
+    # Only the interpreter's own search path counts
+    sys.path = [entry for entry in sys.path if entry]
+stdout, sys.stdout = sys.stdout, sys.stderr
+results = {}
+for name in request["names"]:
+    try:
+        spec = importlib.util.find_spec(name)
+    except ImportError:
+        spec = None
+    except Exception as e:
+        results[name] = ["error", f"{type(e).__name__}: {e}"]
+        continue
+    if spec is None:
+        results[name] = ["missing", None]
+    elif spec.origin in (None, "namespace") and spec.submodule_search_locations:
+        results[name] = ["namespace", None]
+    else:
+        results[name] = ["found", spec.origin]
+stdout.write(json.dumps(results))
+"""
+
+
+def check_importable(module_names, python_executable, cwd=None) -> dict:
+    """
+    Checks any number of modules in a single run of the target interpreter,
+    without running the scripts importing them. Returns a dict mapping each
+    name to a (status, detail) tuple, with status 'found', 'namespace',
+    'missing' or 'error'. With a cwd, modules in that directory are found the
+    way a script there would find them; without one, only the interpreter's
+    own search path counts.
+    Raises subprocess.CalledProcessError, FileNotFoundError or ValueError if
+    the interpreter cannot be run or its answer cannot be read.
+    """
+    module_names = sorted(set(module_names))
+    if not module_names:
+        return {}
+    with lock_environment(python_executable):
+        process = subprocess.run(
+            [python_executable, "-c", FIND_SPECS_CODE],
+            input=json.dumps({"names": module_names, "cwd": cwd is not None}),
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=cwd,
+        )
+    return {name: tuple(result) for name, result in json.loads(process.stdout).items()}
+
+
+def find_missing_modules(module_names, python_executable, cwd=None):
+    """
+    Asks the target interpreter which of the given top-level modules cannot be
+    imported, ignoring the stdlib. With a cwd, modules living next to the script
+    are found, just like they would be when the script itself is executed.
+    Modules the interpreter snapshot already lists as installed are not asked about.
+    """
+    try:
+        snapshot = get_interpreter_snapshot(python_executable)
+        known = set(snapshot["stdlib"]) | set(snapshot["modules"])
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        logging.debug(f"No snapshot of '{python_executable}': {e}")
+        known = set(getattr(sys, "stdlib_module_names", ())) | set(
+            sys.builtin_module_names
+        )
+    module_names = [name for name in module_names if name not in known]
+
+    try:
+        results = check_importable(module_names, python_executable, cwd=cwd)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        logging.warning(
+            f"Could not check module availability in '{python_executable}': {e}"
+        )
+        return []
+    missing = []
+    for name, (status, detail) in results.items():
+        if status == "missing":
+            missing.append(name)
+        elif status == "error":
+            # Installing would not help; the run reports the real failure
+            logging.debug(f"Checking '{name}' failed: {detail}")
+    return missing
+
+
+def is_local_module(script_dir, module_name):
+    """
+    Tells whether a script in script_dir may import module_name from its own
+    directory: a package, namespace directory, source file or extension module
+    named like its top-level part.
+    """
+    top_level = module_name.split(".")[0]
+    if os.path.isdir(os.path.join(script_dir, top_level)):
+        return True
+    try:
+        entries = os.listdir(script_dir)
+    except OSError:
+        return False
+    return any(
+        entry.partition(".")[0] == top_level
+        and entry.endswith((".py", ".pyc", ".so", ".pyd"))
+        for entry in entries
+    )
+
+
+def find_missing_imports(scans, python_executable):
+    """
+    Returns the modules imported by the scanned scripts (a dict mapping each
+    script path to its imported module names) that the target interpreter
+    lacks. The union of all imports is checked in one interpreter run; names
+    found missing there are then dropped for scripts that have a module of
+    that name next to them.
+    """
+    union = set().union(*scans.values())
+    missing = set(find_missing_modules(union, python_executable))
+    missing_modules = set()
+    for path, module_names in scans.items():
+        script_dir = os.path.dirname(os.path.abspath(path))
+        missing_modules.update(
+            name
+            for name in module_names & missing
+            if not is_local_module(script_dir, name)
+        )
+    return missing_modules
+
+
+def prescan_dependencies(script_path, python_executable):
+    """
+    Statically scans a script and returns the imported modules missing from the target interpreter.
+    """
+    try:
+        module_names = scan_imports(script_path)
+    except (OSError, SyntaxError, ValueError) as e:
+        logging.warning(f"Static import scan of '{script_path}' failed: {e}")
+        return []
+
+    logging.debug(f"Statically detected imports: {sorted(module_names)}")
+    script_dir = os.path.dirname(os.path.abspath(script_path))
+    return find_missing_modules(module_names, python_executable, cwd=script_dir)
+
+
+def find_local_module_files(source_path, module_name, level, root_dir):
+    """
+    Returns the files under root_dir an import statement in source_path can
+    refer to: the module itself plus the __init__.py of every parent package.
+    """
+    if level:
+        base_dir = os.path.dirname(source_path)
+        for _ in range(level - 1):
+            base_dir = os.path.dirname(base_dir)
+    else:
+        base_dir = root_dir
+
+    files = []
+    parts = module_name.split(".") if module_name else []
+    for depth in range(1, len(parts) + 1):
+        path = os.path.join(base_dir, *parts[:depth])
+        for candidate in (path + ".py", os.path.join(path, "__init__.py")):
+            if os.path.isfile(candidate):
+                files.append(candidate)
+    return files
+
+
+def hash_script_tree(script_path):
+    """
+    Hashes the script together with every local module it transitively imports,
+    so edits to helper files next to the script invalidate cached resolutions.
+    """
+    script_path = os.path.abspath(script_path)
+    root_dir = os.path.dirname(script_path)
+    digest = hashlib.sha256()
+    pending = [script_path]
+    seen = set()
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(path, "rb") as f:
+            source = f.read()
+        digest.update(os.path.relpath(path, root_dir).encode() + b"\0" + source)
+        try:
+            tree = ast.parse(source, filename=path)
+        except (SyntaxError, ValueError):
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    pending += find_local_module_files(path, alias.name, 0, root_dir)
+            elif isinstance(node, ast.ImportFrom):
+                pending += find_local_module_files(
+                    path, node.module, node.level, root_dir
+                )
+                # 'from pkg import submodule' may name modules too
+                for alias in node.names:
+                    name = ".".join(filter(None, [node.module, alias.name]))
+                    pending += find_local_module_files(path, name, node.level, root_dir)
+    return digest.hexdigest()
+
+
+# Executed by the target interpreter: prints everything the resolver needs to
+# know about it. The installed distributions and importable top-level modules
+# are read from sys.path without the current directory, so the result does
+# not depend on where it runs.
+INTERPRETER_SNAPSHOT_CODE = """
+import importlib.metadata, json, pkgutil, sys, sysconfig
+paths = sysconfig.get_paths()
+search_path = [entry for entry in sys.path if entry]
+print(json.dumps({
+    "version": list(sys.version_info[:2]),
+    "tag": f"{sys.implementation.cache_tag}{getattr(sys, 'abiflags', '')}-{sysconfig.get_platform()}",
+    "paths": paths,
+    "site_packages": list(dict.fromkeys([paths["purelib"], paths["platlib"]])),
+    "sys_path": sys.path,
+    "stdlib": sorted(set(getattr(sys, "stdlib_module_names", ())) | set(sys.builtin_module_names)),
+    "distributions": sorted(
+        f"{dist.metadata['Name']}=={dist.version}"
+        for dist in importlib.metadata.distributions(path=search_path)
+    ),
+    "modules": sorted({module.name for module in pkgutil.iter_modules(search_path)}),
+}))
+"""
+
+# Snapshots already loaded by this process, by interpreter path
+interpreter_snapshots = {}
+
+
+def get_interpreter_snapshots_dir() -> str:
+    """
+    Returns the directory holding the cached interpreter snapshots.
+    """
+    return os.path.join(get_cache_dir(), "interpreters")
+
+
+def fingerprint_search_path(executable, search_path):
+    """
+    Returns a cheap fingerprint of an interpreter and everything installed into
+    it. Only stat() calls are involved: the interpreter binary, each entry on
+    its search path, and every distribution metadata and .pth file they contain.
+    """
+    executable = os.path.realpath(executable)
+    digest = hashlib.sha256(executable.encode())
+    digest.update(str(os.stat(executable).st_mtime_ns).encode())
+    for path_entry in search_path:
+        # The current directory depends on where the tool runs, not the environment
+        if not path_entry or not os.path.isdir(path_entry):
+            continue
+        digest.update(path_entry.encode())
+        with os.scandir(path_entry) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if entry.name.endswith(
+                    (".dist-info", ".egg-info", ".pth", ".egg-link")
+                ):
+                    digest.update(f"{entry.name}:{entry.stat().st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def get_interpreter_snapshot(python_executable) -> dict:
+    """
+    Returns what the target interpreter reports about itself: its version, tag,
+    sysconfig paths, site-packages, sys.path, stdlib module names, installed
+    distributions (as name==version) and importable top-level modules, plus the
+    fingerprint of its environment.
+    The interpreter is only spawned when nothing is cached on disk for its path
+    and mtime, or when the fingerprint shows that something was installed or
+    removed since, so repeated checks during a run cost a few stat() calls.
+    """
+    executable = os.path.abspath(shutil.which(python_executable) or python_executable)
+    # A recreated venv keeps its path but gets a new interpreter symlink
+    key = [
+        executable,
+        os.stat(executable).st_mtime_ns,
+        os.lstat(executable).st_mtime_ns,
+        os.environ.get("PYTHONPATH", ""),
+    ]
+    snapshot_file = os.path.join(
+        get_interpreter_snapshots_dir(),
+        hashlib.sha256(executable.encode()).hexdigest()[:16] + ".json",
+    )
+
+    cached = interpreter_snapshots.get(executable)
+    if cached is None:
+        try:
+            with open(snapshot_file, "r") as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            cached = None
+    fingerprint = None
+    if cached and cached["key"] == key:
+        fingerprint = fingerprint_search_path(
+            executable, cached["snapshot"]["sys_path"]
+        )
+        if fingerprint == cached["fingerprint"]:
+            interpreter_snapshots[executable] = cached
+            return dict(cached["snapshot"], fingerprint=fingerprint)
+
+    process = subprocess.run(
+        [python_executable, "-c", INTERPRETER_SNAPSHOT_CODE],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    snapshot = json.loads(process.stdout)
+    # If the environment changed while the interpreter was reading it, the
+    # snapshot may be half old; it is returned but never trusted again
+    new_fingerprint = fingerprint_search_path(executable, snapshot["sys_path"])
+    cached = {
+        "key": key,
+        "fingerprint": (
+            new_fingerprint if fingerprint in (None, new_fingerprint) else None
+        ),
+        "snapshot": snapshot,
+    }
+    interpreter_snapshots[executable] = cached
+    try:
+        write_json_atomic(snapshot_file, cached)
+    except OSError as e:
+        logging.debug(f"Could not cache the snapshot of '{python_executable}': {e}")
+    return dict(snapshot, fingerprint=new_fingerprint)
+
+
+def get_resolution_key(script_path, python_executable, environment_hash=None):
+    """
+    Returns the resolution cache key for a script in an environment, or None
+    if either of them cannot be fingerprinted. A precomputed environment_hash
+    saves fingerprinting the same environment for many scripts.
+    """
+    try:
+        script_hash = hash_script_tree(script_path)
+        if environment_hash is None:
+            environment_hash = get_interpreter_snapshot(python_executable)[
+                "fingerprint"
+            ]
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        logging.debug(f"Resolution cache unavailable: {e}")
+        return None
+    return f"{script_hash}:{environment_hash}"
+
+
+def get_resolution_cache_file() -> str:
+    """
+    Returns the path of the cache of scripts already resolved in an environment.
+    """
+    return os.path.join(get_cache_dir(), "resolutions.json")
+
+
+def load_resolution_cache() -> dict:
+    """
+    Loads the resolution cache, returning an empty one if it is missing or corrupt.
+    """
+    try:
+        with open(get_resolution_cache_file(), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+# Upper bound on cached resolutions; the oldest entries are dropped first
+RESOLUTION_CACHE_SIZE = 10000
+
+
+def record_resolutions(resolutions):
+    """
+    Remembers scripts as fully resolved. resolutions maps cache keys to the
+    script path each one was computed for.
+    """
+    cache = load_resolution_cache()
+    for key, script_path in resolutions.items():
+        cache[key] = {
+            "script": os.path.abspath(script_path),
+            "resolved_at": time.time(),
+        }
+    if len(cache) > RESOLUTION_CACHE_SIZE:
+        newest = sorted(cache.items(), key=lambda item: item[1]["resolved_at"])
+        cache = dict(newest[-RESOLUTION_CACHE_SIZE:])
+    try:
+        write_json_atomic(get_resolution_cache_file(), cache)
+    except OSError as e:
+        logging.warning(f"Could not save resolution cache: {e}")
+
+
+# Bootstrap the target interpreter runs the script through. It optionally:
+#  - watches the import system and reports the import phase as completed once the
+#    script's body has run past its last top-level import statement (or the
+#    last one under its main guard) and no new module has been imported for a
+#    while, so long-running scripts can be stopped right away instead of
+#    waiting for the timeout;
+#  - appends a last-resort sys.meta_path finder (probe mode) that records every
+#    import the script (or its local modules) cannot resolve, and hands back a
+#    permissive stub module so execution continues past the failure.
+# The JSON report is rewritten on every change, so it survives the child being
+# killed.
+BOOTSTRAP_CODE = r"""
+import ast, importlib.abc, importlib.machinery, json, os, runpy, sys, threading
+import time, traceback, types
+
+report_path = sys.argv[1]
+import_idle = int(sys.argv[2]) / 1000
+stub_imports = sys.argv[3] == "1"
+script_path = os.path.abspath(sys.argv[4])
+script_dir = os.path.dirname(script_path)
+report = {"missing": [], "completed": False, "imports_completed": False}
+report_lock = threading.Lock()
+last_import = time.monotonic()
+# Set by a call inserted after the script's last top-level import statement
+imports_entered = threading.Event()
+
+
+def write_report(**changes):
+    with report_lock:
+        report.update(changes)
+        tmp_path = report_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f)
+        os.replace(tmp_path, report_path)
+
+
+def is_local_import():
+    # Only imports issued by the user's code are stubbed; optional imports
+    # inside installed libraries must keep failing the normal way.
+    frame = sys._getframe(2)
+    while frame and frame.f_code.co_filename.startswith("<frozen importlib"):
+        frame = frame.f_back
+    if frame is None:
+        return False
+    filename = os.path.abspath(frame.f_code.co_filename)
+    return (
+        filename.startswith(script_dir + os.sep)
+        and not filename.startswith(sys.prefix + os.sep)
+        and "site-packages" not in filename
+    )
+
+
+class ImportTracker(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        global last_import
+        last_import = time.monotonic()
+        return None
+
+
+def watch_imports():
+    imports_entered.wait()
+    while True:
+        idle = time.monotonic() - last_import
+        if idle >= import_idle:
+            write_report(imports_completed=True)
+            return
+        time.sleep(import_idle - idle)
+
+
+class Stub:
+    def __init__(self, name):
+        object.__setattr__(self, "_stub_name", name)
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)
+        return Stub(f"{self._stub_name}.{attr}")
+
+    def __setattr__(self, attr, value):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        # Behave as a pass-through decorator when applied to a function or class
+        if len(args) == 1 and not kwargs and callable(args[0]):
+            return args[0]
+        return Stub(f"{self._stub_name}()")
+
+    def __getitem__(self, key):
+        return Stub(f"{self._stub_name}[]")
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __mro_entries__(self, bases):
+        return (object,)
+
+    def __repr__(self):
+        return f"<missing {self._stub_name}>"
+
+
+def record_submodule(fullname):
+    # The most specific name tells which distribution is missing, e.g.
+    # google.cloud.storage rather than the google namespace
+    parent = fullname.rpartition(".")[0]
+    missing = report["missing"]
+    if parent in missing:
+        write_report(missing=[fullname if name == parent else name for name in missing])
+    elif fullname not in missing and any(
+        name.startswith(parent + ".") for name in missing
+    ):
+        # A sibling of a submodule recorded before
+        write_report(missing=missing + [fullname])
+
+
+class StubLoader(importlib.abc.Loader):
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        def module_getattr(attr):
+            if attr.startswith("__") and attr.endswith("__"):
+                raise AttributeError(attr)
+            if sys._getframe(1).f_code.co_name == "_handle_fromlist":
+                # 'from google.cloud import storage' may name a submodule
+                record_submodule(f"{module.__name__}.{attr}")
+            return Stub(f"{module.__name__}.{attr}")
+
+        module.__path__ = []
+        module.__getattr__ = module_getattr
+
+
+class StubFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        parent = fullname.rpartition(".")[0]
+        stubbed_parent = parent and isinstance(
+            getattr(sys.modules.get(parent), "__loader__", None), StubLoader
+        )
+        if not stubbed_parent:
+            if not is_local_import():
+                return None
+            write_report(missing=report["missing"] + [fullname])
+        else:
+            record_submodule(fullname)
+        return importlib.machinery.ModuleSpec(fullname, StubLoader(), is_package=True)
+
+
+def is_main_guard(node):
+    if not isinstance(node, ast.If) or not isinstance(node.test, ast.Compare):
+        return False
+    operands = [node.test.left, *node.test.comparators]
+    return (
+        len(operands) == 2
+        and isinstance(node.test.ops[0], ast.Eq)
+        and any(isinstance(operand, ast.Name) and operand.id == "__name__" for operand in operands)
+        and any(isinstance(operand, ast.Constant) and operand.value == "__main__" for operand in operands)
+    )
+
+
+def run_script():
+    if not import_idle:
+        runpy.run_path(script_path, run_name="__main__")
+        return
+    try:
+        with open(script_path, "rb") as f:
+            tree = ast.parse(f.read(), filename=script_path)
+    except (OSError, SyntaxError, ValueError):
+        # Let runpy report the problem the usual way
+        runpy.run_path(script_path, run_name="__main__")
+        return
+    # The module docstring has to stay the first statement
+    position = int(bool(ast.get_docstring(tree, clean=False)))
+    body, anchor = tree.body, tree
+    while True:
+        for index, node in enumerate(body):
+            if any(isinstance(child, (ast.Import, ast.ImportFrom)) for child in ast.walk(node)):
+                position = index + 1
+        if not position or not is_main_guard(body[position - 1]):
+            break
+        # Imports under the main guard usually precede a blocking call there
+        anchor = body[position - 1]
+        body, position = anchor.body, 0
+    if position:
+        anchor = body[position - 1]
+    marker = ast.parse("__dependency_guesser_imports_entered__()").body[0]
+    body.insert(position, marker)
+    for node in ast.walk(marker):
+        ast.copy_location(node, anchor)
+    main = types.ModuleType("__main__")
+    main.__file__ = script_path
+    main.__dependency_guesser_imports_entered__ = imports_entered.set
+    sys.modules["__main__"] = main
+    exec(compile(tree, script_path, "exec"), main.__dict__)
+
+
+write_report()
+if import_idle:
+    sys.meta_path.insert(0, ImportTracker())
+    threading.Thread(target=watch_imports, daemon=True).start()
+if stub_imports:
+    sys.meta_path.append(StubFinder())
+sys.argv = [script_path]
+sys.path[0] = script_dir
+if stub_imports:
+    try:
+        run_script()
+    except BaseException:
+        # Stubs are not real objects, so the script failing later on is expected
+        traceback.print_exc()
+else:
+    run_script()
+write_report(completed=True)
+"""
+
+# How often the supervisor checks on a running script, in seconds
+WATCHDOG_POLL_INTERVAL = 0.05
+# Time a script is given to exit on its own after an import failure shows up
+# in its stderr, in seconds. An interpreter printing an unhandled traceback
+# exits right away; a script printing a handled one keeps running.
+STOP_GRACE_PERIOD = 0.2
+
+# How much of each output stream is kept in memory; tracebacks live at the end
+DEFAULT_CAPTURE_LIMIT = 64 * 1024
+
+
+class TailBuffer:
+    """
+    Bounded byte buffer that keeps only the last `limit` bytes written to it.
+    Bytes are decoded only when the text is actually requested.
+    """
+
+    def __init__(self, limit=DEFAULT_CAPTURE_LIMIT):
+        self.limit = limit
+        self.total = 0
+        self.data = bytearray()
+
+    def write(self, data):
+        self.total += len(data)
+        self.data += data
+        # Trimming only once twice the limit is reached keeps writes amortized O(1)
+        if len(self.data) > 2 * self.limit:
+            del self.data[: len(self.data) - self.limit]
+
+    def getvalue(self):
+        return bytes(self.data[-self.limit :]) if self.limit else b""
+
+    def text(self):
+        tail = self.getvalue().decode(errors="replace")
+        omitted = self.total - min(self.total, self.limit)
+        if omitted:
+            return f"[... {omitted} earlier bytes omitted ...]\n{tail}"
+        return tail
+
+
+@dataclass
+class ScriptRun:
+    """
+    Outcome of one supervised execution of the target script.
+    """
+
+    returncode: Optional[int] = None
+    stdout_tail: TailBuffer = field(default_factory=TailBuffer)
+    stderr_tail: TailBuffer = field(default_factory=TailBuffer)
+    timed_out: bool = False
+    imports_completed: bool = False
+    import_failure: Optional[ImportFailure] = None
+    missing: list = field(default_factory=list)
+
+    @property
+    def stdout(self):
+        return self.stdout_tail.text()
+
+    @property
+    def stderr(self):
+        return self.stderr_tail.text()
+
+
+def read_report(report_path):
+    """
+    Reads the bootstrap's JSON report, returning an empty dict if it is not there (yet).
+    """
+    try:
+        with open(report_path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+async def run_script_async(
+    script_path,
+    timeout,
+    python_executable,
+    import_idle_ms=0,
+    stub_imports=False,
+    stop_on_missing=True,
+    capture_limit=DEFAULT_CAPTURE_LIMIT,
+    output_log=None,
+):
+    """
+    Runs the script in the target interpreter and supervises it until it exits.
+    Stderr is scanned as it streams in and, with stop_on_missing, the child is
+    killed as soon as a missing module shows up. With import_idle_ms set, the
+    child is also stopped once its import phase has been idle for that long.
+    Only the last capture_limit bytes of each stream are kept in memory; the
+    complete output is appended to output_log when one is given.
+    Raises FileNotFoundError if the interpreter cannot be launched and
+    ValueError if capture_limit is not a positive number of bytes.
+    """
+    if capture_limit <= 0:
+        raise ValueError(f"capture_limit must be positive, got {capture_limit}")
+    with tempfile.TemporaryDirectory(prefix="dependency_guesser_") as tmp_dir:
+        bootstrap_path = os.path.join(tmp_dir, "bootstrap.py")
+        report_path = os.path.join(tmp_dir, "report.json")
+        if import_idle_ms or stub_imports:
+            with open(bootstrap_path, "w") as f:
+                f.write(BOOTSTRAP_CODE)
+            command = [
+                python_executable,
+                bootstrap_path,
+                report_path,
+                str(import_idle_ms),
+                "1" if stub_imports else "0",
+                script_path,
+            ]
+        else:
+            command = [python_executable, script_path]
+
+        result = ScriptRun(
+            stdout_tail=TailBuffer(capture_limit), stderr_tail=TailBuffer(capture_limit)
+        )
+        log_file = None
+        stopped = asyncio.Event()
+
+        async def pump(stream, tail, scan):
+            pending = b""  # trailing stderr bytes that do not form a full line yet
+            traceback = ""  # complete lines since the latest traceback header
+            while data := await stream.read(65536):
+                tail.write(data)
+                if log_file:
+                    log_file.write(data)
+                if not scan or result.import_failure:
+                    continue
+                pending += data
+                end = pending.rfind(b"\n") + 1
+                if end:
+                    text = pending[:end].decode(errors="replace")
+                    pending = pending[end:]
+                    # The frames may arrive in an earlier read than the message
+                    traceback += text
+                    start = traceback.rfind(TRACEBACK_HEADER)
+                    traceback = (
+                        traceback[start:][-capture_limit:] if start >= 0 else text
+                    )
+                    # Log noise never reaches the classifiers
+                    if TRACEBACK_HEADER in text or has_failure_trigger(text):
+                        result.import_failure = parse_import_failure(traceback)
+                        if result.import_failure:
+                            stopped.set()
+                # A runaway line without newlines is not a traceback
+                pending = pending[-capture_limit:]
+
+        async def watch_imports():
+            while not read_report(report_path).get("imports_completed"):
+                await asyncio.sleep(WATCHDOG_POLL_INTERVAL)
+            result.imports_completed = True
+            stopped.set()
+
+        async def wait_for_exit():
+            await asyncio.gather(
+                pump(process.stdout, result.stdout_tail, False),
+                pump(process.stderr, result.stderr_tail, stop_on_missing),
+            )
+            await process.wait()
+
+        try:
+            if output_log:
+                log_file = open(output_log, "ab")
+            # Other resolvers must not install into the environment while it runs
+            async with lock_environment(python_executable):
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                exit_task = asyncio.ensure_future(wait_for_exit())
+                killed = False
+                watchers = [asyncio.ensure_future(stopped.wait())]
+                if import_idle_ms:
+                    watchers.append(asyncio.ensure_future(watch_imports()))
+                try:
+                    done, _ = await asyncio.wait(
+                        [exit_task, *watchers],
+                        timeout=timeout,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if not done:
+                        result.timed_out = True
+                    elif result.import_failure and not exit_task.done():
+                        await asyncio.wait([exit_task], timeout=STOP_GRACE_PERIOD)
+                    if not exit_task.done():
+                        killed = True
+                        try:
+                            process.kill()
+                        except ProcessLookupError:
+                            pass  # It exited on its own in the meantime
+                        # Let the readers collect what is left, unless a grandchild
+                        # keeps the pipes open
+                        await asyncio.wait([exit_task], timeout=1)
+                        await process.wait()
+                finally:
+                    for task in [exit_task, *watchers]:
+                        task.cancel()
+                result.returncode = process.returncode
+        finally:
+            if log_file:
+                log_file.close()
+        if result.import_failure and not killed:
+            # The streamed failure may have been handled; what ended the run decides
+            result.import_failure = parse_import_failure(result.stderr)
+
+        result.missing = read_report(report_path).get("missing", [])
+    return result
+
+
+async def probe_missing_modules(
+    script_path, timeout, python_executable, import_idle_ms=0
+):
+    """
+    Runs the script once under the import-hook probe and returns every module
+    it failed to import, in the order the imports happened.
+    """
+    logging.info(f"--- Probing '{script_path}' for missing imports ---")
+    try:
+        run = await run_script_async(
+            script_path,
+            timeout,
+            python_executable,
+            import_idle_ms,
+            stub_imports=True,
+            stop_on_missing=False,
+        )
+    except FileNotFoundError:
+        logging.warning(f"Could not launch probe with '{python_executable}'.")
+        return []
+
+    if run.timed_out:
+        logging.info("Probe timed out; using the imports recorded so far.")
+    return run.missing
+
+
+# Executed by the target interpreter: reads distribution names from stdin and
+# prints the metadata files describing the modules each one provides.
+DISTRIBUTION_FILES_CODE = """
+import importlib.metadata, json, sys
+result = {}
+for name in json.load(sys.stdin):
+    try:
+        dist = importlib.metadata.distribution(name)
+    except importlib.metadata.PackageNotFoundError:
+        continue
+    result[dist.metadata["Name"]] = [dist.read_text("top_level.txt"), dist.read_text("RECORD")]
+print(json.dumps(result))
+"""
+
+# Modules provided by distributions installed during this run, by environment path
+satisfied_modules = {}
+
+
+def get_satisfied_modules(python_executable) -> set:
+    """
+    Returns the modules provided by distributions installed into the
+    interpreter's environment during this run.
+    """
+    return satisfied_modules.setdefault(get_environment_path(python_executable), set())
+
+
+def get_learned_aliases_file() -> str:
+    """
+    Returns the path of the learned aliases store, kept next to aliases.json.
+    """
+    return os.path.join(get_local_dir(), "learned_aliases.json")
+
+
+def load_learned_aliases() -> dict:
+    """
+    Loads the module aliases learned from earlier successful installs.
+    Namespace packages learned by older versions are dropped, as their name
+    alone does not identify a distribution.
+    """
+    try:
+        with open(get_learned_aliases_file(), "r") as f:
+            learned = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return {
+        module: alias
+        for module, alias in learned.items()
+        if module not in NAMESPACE_PACKAGES
+    }
+
+
+def learn_installed_modules(pip_args, python_executable):
+    """
+    Reads which modules the distributions named in pip_args actually provide,
+    now that they are installed, and remembers them: modules whose name differs
+    from their distribution are persisted as learned aliases, and all of them
+    are marked as satisfied for the rest of the run. Namespace packages are
+    skipped like in the module index; only the dotted names of the packages
+    below them are learned.
+    """
+    names = [
+        arg
+        for arg in pip_args
+        if not arg.startswith("-") and re.fullmatch(r"[A-Za-z0-9][\w.-]*", arg)
+    ]
+    if not names:
+        return
+
+    try:
+        process = subprocess.run(
+            [python_executable, "-c", DISTRIBUTION_FILES_CODE],
+            input=json.dumps(names),
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        distributions = json.loads(process.stdout)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        logging.debug(f"Could not read metadata of installed {names}: {e}")
+        return
+
+    learned = {}
+    for name, (top_level_text, record_text) in distributions.items():
+        files = {line.split(",")[0] for line in (record_text or "").splitlines()}
+        modules = [
+            module
+            for module in parse_top_level_modules(top_level_text, record_text)
+            # A directory without __init__.py is a namespace shared with others
+            if not any(path.startswith(module + "/") for path in files)
+            or module + "/__init__.py" in files
+        ]
+        for module in modules + parse_namespace_modules(record_text):
+            if module in NAMESPACE_PACKAGES:
+                continue
+            get_satisfied_modules(python_executable).add(module)
+            if (
+                normalize_distribution_name(module) != normalize_distribution_name(name)
+                and module not in aliases
+            ):
+                learned[module] = {"package_name": name, "cwd": None}
+    if not learned:
+        return
+
+    logging.debug(f"Learned module aliases: {learned}")
+    aliases.update(learned)
+    learned_aliases_file = get_learned_aliases_file()
+    try:
+        # Other resolvers may be learning at the same time
+        with EnvironmentLock(learned_aliases_file, exclusive=True):
+            store = load_learned_aliases()
+            store.update(learned)
+            write_json_atomic(learned_aliases_file, store, indent=2, sort_keys=True)
+    except OSError as e:
+        logging.warning(f"Could not save learned aliases: {e}")
+
+
+# Hand-written aliases take precedence over learned ones
+aliases = {**load_learned_aliases(), **load_aliases()}
+
+
+def find_imported_name(filename, lineno, module_name):
+    """
+    Returns the full dotted name imported at the given line of a source file
+    when it lies below module_name, or module_name itself. Python reports only
+    the first missing part ('google' for 'import google.cloud.storage'), which
+    says nothing about the distribution when that part is a namespace package.
+    """
+    try:
+        with open(filename, "rb") as f:
+            tree = ast.parse(f.read(), filename=filename)
+    except (OSError, SyntaxError, ValueError):
+        return module_name
+    for node in ast.walk(tree):
+        if getattr(node, "lineno", None) != lineno:
+            continue
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            # 'from google.cloud import storage' may import a submodule
+            names = [f"{node.module}.{alias.name}" for alias in node.names]
+            names.append(node.module)
+        else:
+            continue
+        for name in names:
+            if name.startswith(module_name + "."):
+                return name
+    return module_name
+
+
+def resolve_dotted_module(module_name, python_executable):
+    """
+    Picks the name to install for a missing dotted module such as
+    'google.cloud.storage', walking its prefixes from the most to the least
+    specific. The first prefix known to the aliases or the module index wins,
+    skipping namespace packages. Below a prefix that is importable as a
+    regular package, the missing module belongs to that package, so its
+    top-level name is returned. Otherwise the shortest prefix that is not a
+    namespace is returned, which pip normalizes to a distribution name
+    ('google.cloud.storage' -> 'google-cloud-storage').
+    """
+    if "." not in module_name:
+        return module_name
+    parts = module_name.split(".")
+    prefixes = [".".join(parts[:depth]) for depth in range(len(parts), 0, -1)]
+    try:
+        results = check_importable(prefixes, python_executable)
+        statuses = {name: status for name, (status, _) in results.items()}
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        logging.debug(
+            f"Could not inspect '{module_name}' in '{python_executable}': {e}"
+        )
+        statuses = {}
+
+    def is_namespace(prefix):
+        return prefix in NAMESPACE_PACKAGES or statuses.get(prefix) == "namespace"
+
+    module_index = load_module_index()
+    for prefix in prefixes:
+        if statuses.get(prefix) == "found":
+            # The missing part belongs to an installed package
+            resolved = parts[0] if not is_namespace(parts[0]) else prefix
+            break
+        if not is_namespace(prefix) and (prefix in aliases or prefix in module_index):
+            resolved = prefix
+            break
+    else:
+        resolved = next(
+            (prefix for prefix in reversed(prefixes) if not is_namespace(prefix)),
+            module_name,
+        )
+    if resolved != module_name:
+        logging.info(f"Resolved missing module '{module_name}' to '{resolved}'.")
+    return resolved
+
+
+def confirm_install(package_names, upgrade=False):
+    """
+    Asks the user whether the given packages should be installed (or upgraded).
+    Exits the program if the prompt is interrupted.
+    """
+    names = ", ".join(f"'{name}'" for name in package_names)
+    noun = "package" if len(package_names) == 1 else "packages"
+    question = "Outdated {}. Upgrade" if upgrade else "Missing {}. Install"
+    try:
+        prompt = input(f"{question.format(noun)} {names} with pip? [Y/n] ")
+    except KeyboardInterrupt:
+        logging.info("\nInstallation cancelled by user.")
+        sys.exit(1)
+    return prompt.lower().strip() in ["", "y", "yes"]
+
+
+def get_pip_args(package_name):
+    """
+    Maps a module name through the aliases (or the module index) to pip install
+    arguments and the directory pip has to run from.
+    """
+    alias = aliases.get(package_name)
+    if alias is None:
+        # Explicit aliases win; otherwise ask the index which distribution
+        # provides this import name
+        distribution = load_module_index().get(package_name, package_name)
+        alias = {"package_name": distribution, "cwd": None}
+    if alias["package_name"] == ".":
+        return ["-e", "."], alias.get("cwd")
+    return [alias["package_name"]], alias.get("cwd")
+
+
+# Set from the command line; pip then only looks up distributions in this directory
+wheelhouse_dir = None
+
+# Distribution files pip can install from a --find-links directory
+WHEELHOUSE_EXTENSIONS = (".whl", ".tar.gz", ".tar.bz2", ".zip")
+
+
+@functools.lru_cache(maxsize=None)
+def scan_wheelhouse(path, mtime_ns) -> dict:
+    """
+    Maps the normalized distribution names found in a wheelhouse directory to
+    their files. mtime_ns is only part of the cache key, so the directory is
+    scanned again as soon as files are added to or removed from it.
+    """
+    index = {}
+    for entry in os.scandir(path):
+        filename = entry.name
+        extension = next(
+            (ext for ext in WHEELHOUSE_EXTENSIONS if filename.endswith(ext)), None
+        )
+        if extension is None or not entry.is_file():
+            continue
+        if extension == ".whl":
+            name = filename.split("-")[0]
+        else:
+            name = filename[: -len(extension)].rsplit("-", 1)[0]
+        index.setdefault(normalize_distribution_name(name), []).append(filename)
+    return index
+
+
+def load_wheelhouse_index(path) -> dict:
+    """
+    Returns the name to files index of a wheelhouse directory, or an empty one
+    if it cannot be read.
+    """
+    try:
+        return scan_wheelhouse(os.path.abspath(path), os.stat(path).st_mtime_ns)
+    except OSError as e:
+        logging.warning(f"Could not read wheelhouse '{path}': {e}")
+        return {}
+
+
+# Download directories of the running prefetchers, each with the requirements
+# whose whole closure was downloaded there
+prefetched = {}
+
+
+def get_index_args(pip_args=()):
+    """
+    Returns the pip options restricting lookups to the wheelhouse, if one is
+    set, or to a prefetch directory that already holds everything pip_args need.
+    """
+    if wheelhouse_dir is not None:
+        return ["--no-index", "--find-links", os.path.abspath(wheelhouse_dir)]
+    requirements = [arg for arg in pip_args if not arg.startswith("-")]
+    for download_dir, requirements_done in prefetched.items():
+        if requirements and all(r in requirements_done for r in requirements):
+            # Everything is local already; skip the index round trips
+            return ["--no-index", "--find-links", download_dir]
+    return []
+
+
+def find_missing_from_wheelhouse(pip_args):
+    """
+    Returns the requirements in pip_args that the wheelhouse has no files for.
+    Options and editable projects are not checked.
+    """
+    if wheelhouse_dir is None:
+        return []
+    index = load_wheelhouse_index(wheelhouse_dir)
+    missing = []
+    for previous, arg in zip([None] + pip_args, pip_args):
+        if arg.startswith("-") or previous == "-e":
+            continue
+        name = normalize_distribution_name(re.split(r"[<>=!~\[;@ ]", arg)[0])
+        if name not in index:
+            missing.append(arg)
+    return missing
+
+
+# Executed by the target interpreter: a long-lived pip that reads one JSON
+# request ({"args": [...], "cwd": ...}) per line from stdin and answers each
+# with a JSON line holding pip's return code and captured output. The protocol
+# uses a copy of the original stdout; fd 1 itself is pointed at stderr so the
+# output of build subprocesses cannot corrupt it.
+PIP_WORKER_CODE = """
+import contextlib, importlib, io, json, os, sys
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from pip._internal.cli.main import main
+for line in sys.stdin:
+    request = json.loads(line)
+    stdout, stderr = io.StringIO(), io.StringIO()
+    importlib.invalidate_caches()
+    # pip's pkg_resources backend caches the installed distributions
+    pkg_resources = sys.modules.get("pip._vendor.pkg_resources")
+    if pkg_resources:
+        pkg_resources.working_set = pkg_resources.WorkingSet()
+    cwd = os.getcwd()
+    try:
+        if request["cwd"]:
+            os.chdir(request["cwd"])
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                returncode = main(request["args"])
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        returncode = 1
+        stderr.write(f"{type(e).__name__}: {e}\\n")
+    finally:
+        os.chdir(cwd)
+    protocol.write(json.dumps({
+        "returncode": returncode or 0,
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+    }) + "\\n")
+    protocol.flush()
+"""
+
+
+class PipWorker:
+    """
+    A pip process of one interpreter that stays alive between requests, so
+    Python and pip are only imported once. A worker that died is restarted.
+    """
+
+    def __init__(self, python_executable):
+        self.python_executable = python_executable
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        logging.debug(f"Starting a pip worker for '{self.python_executable}'.")
+        self.process = subprocess.Popen(
+            [self.python_executable, "-c", PIP_WORKER_CODE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+
+    def request(self, pip_args, cwd=None):
+        """
+        Runs pip with the given arguments and returns a (returncode, stdout,
+        stderr) tuple. Raises OSError if the worker dies even after a restart.
+        """
+        message = json.dumps({"args": pip_args, "cwd": cwd and os.path.abspath(cwd)})
+        with self.lock:
+            for _ in range(2):
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                try:
+                    self.process.stdin.write(message + "\n")
+                    self.process.stdin.flush()
+                    line = self.process.stdout.readline()
+                except OSError:
+                    line = ""
+                if line:
+                    response = json.loads(line)
+                    return (
+                        response["returncode"],
+                        response["stdout"],
+                        response["stderr"],
+                    )
+                logging.warning(
+                    f"The pip worker for '{self.python_executable}' died; restarting it."
+                )
+                self.process.kill()
+                self.process.wait()
+                self.process = None
+        raise OSError(f"The pip worker for '{self.python_executable}' keeps dying.")
+
+
+# One worker per environment, started on first use
+pip_workers = {}
+pip_workers_lock = threading.Lock()
+
+
+def get_pip_worker(python_executable) -> PipWorker:
+    """
+    Returns the pip worker of the environment python_executable belongs to.
+    """
+    with pip_workers_lock:
+        environment = get_environment_path(python_executable)
+        if environment not in pip_workers:
+            pip_workers[environment] = PipWorker(python_executable)
+        return pip_workers[environment]
+
+
+def run_pip(
+    command, pip_args, python_executable, cwd=None, exclusive=True, use_worker=False
+):
+    """
+    Runs a single pip command (such as 'install') with the given arguments,
+    holding the environment lock (exclusive unless the command only reads).
+    With use_worker, the command is sent to the environment's pip worker
+    instead of starting a new pip process.
+    Returns a (success, output) tuple, where output is pip's stdout on success
+    and an error message otherwise.
+    """
+    label = " ".join(pip_args)
+    if command in ("install", "wheel", "download"):
+        pip_args = get_index_args(pip_args) + pip_args
+    try:
+        with lock_environment(python_executable, exclusive=exclusive):
+            if use_worker:
+                returncode, stdout, stderr = get_pip_worker(python_executable).request(
+                    [command] + pip_args, cwd
+                )
+                if returncode:
+                    raise subprocess.CalledProcessError(
+                        returncode, command, stdout, stderr
+                    )
+                return True, stdout
+            # Running pip as a module of the potentially virtualized python
+            pip_process = subprocess.run(
+                [python_executable, "-m", "pip", command] + pip_args,
+                check=True,
+                capture_output=True,
+                text=True,
+                cwd=cwd,
+            )
+        return True, pip_process.stdout
+    except subprocess.CalledProcessError as e:
+        error_message = f"Failed to {command} '{label}'.\n"
+        error_message += f"pip exited with status {e.returncode}.\n"
+        error_message += f"Stderr:\n{e.stderr}"
+        return False, error_message
+    except FileNotFoundError:
+        error_message = f"Error: '{python_executable}' command not found. Is Python installed and in your PATH?"
+        return False, error_message
+    except OSError as e:
+        return False, f"Failed to {command} '{label}': {e}"
+
+
+def run_pip_install(pip_args, python_executable, cwd=None):
+    """
+    Runs a single 'pip install' with the given arguments.
+    Returns a (success, output) tuple.
+    """
+    return run_pip("install", pip_args, python_executable, cwd)
+
+
+def run_pip_dry_run(pip_args, python_executable, cwd=None):
+    """
+    Reports what 'pip install' would do with the given arguments, without installing.
+    Returns a (success, output) tuple.
+    """
+    return run_pip(
+        "install", ["--dry-run"] + pip_args, python_executable, cwd, exclusive=False
+    )
+
+
+def run_pip_uninstall(distribution_names, python_executable):
+    """
+    Uninstalls distributions with 'pip uninstall'.
+    Returns a (success, output) tuple.
+    """
+    return run_pip("uninstall", ["-y"] + distribution_names, python_executable)
+
+
+# Written to the INSTALLER file of distributions linked from the wheel store
+WHEEL_STORE_INSTALLER = "dependency_guesser"
+
+# Template of the console scripts generated for linked distributions (pip's own)
+CONSOLE_SCRIPT_TEMPLATE = """#!{python}
+# -*- coding: utf-8 -*-
+import re
+import sys
+from {module} import {import_name}
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit({call}())
+"""
+
+
+def get_wheel_store_dir() -> str:
+    """
+    Returns the directory of the content-addressed wheel store.
+    """
+    return os.path.join(get_cache_dir(), "wheel_store")
+
+
+def get_wheel_closures_file() -> str:
+    """
+    Returns the path of the file mapping requirements to the wheels they install.
+    """
+    return os.path.join(get_wheel_store_dir(), "closures.json")
+
+
+def load_wheel_closures() -> dict:
+    """
+    Loads the recorded wheel closures: {interpreter tag: {requirement: [wheel entries]}}.
+    """
+    try:
+        with open(get_wheel_closures_file(), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def record_wheel_closure(tag, requirement, wheels):
+    """
+    Remembers the wheels a requirement installs on the interpreter identified by tag.
+    """
+    with EnvironmentLock(get_wheel_store_dir(), exclusive=True):
+        closures = load_wheel_closures()
+        closures.setdefault(tag, {})[requirement] = wheels
+        try:
+            write_json_atomic(get_wheel_closures_file(), closures, indent=2)
+        except OSError as e:
+            logging.warning(f"Could not save wheel closures: {e}")
+
+
+def add_wheel_to_store(wheel_path) -> dict:
+    """
+    Adds a wheel to the store under its SHA-256, unpacked next to the wheel
+    file itself, and returns its store entry.
+    """
+    sha256 = hash_file(wheel_path)
+    filename = os.path.basename(wheel_path)
+    name, version = filename.split("-")[:2]
+    entry_dir = os.path.join(get_wheel_store_dir(), sha256)
+    if not os.path.isdir(os.path.join(entry_dir, "tree")):
+        tmp_dir = tempfile.mkdtemp(prefix=f"{sha256}.", dir=get_wheel_store_dir())
+        try:
+            tree = os.path.join(tmp_dir, "tree")
+            with zipfile.ZipFile(wheel_path) as wheel:
+                for member in wheel.infolist():
+                    path = wheel.extract(member, tree)
+                    mode = member.external_attr >> 16
+                    if mode and not member.is_dir():
+                        os.chmod(path, mode & 0o777)
+            shutil.copy2(wheel_path, os.path.join(tmp_dir, filename))
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another resolver stored the same wheel in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(os.path.join(entry_dir, "tree")):
+                raise
+    return {
+        "name": name.replace("_", "-"),
+        "version": version.replace("_", "-"),
+        "sha256": sha256,
+        "filename": filename,
+    }
+
+
+def build_wheel_closure(requirement, python_executable):
+    """
+    Runs 'pip wheel' for a requirement and adds the wheels of its whole
+    dependency closure to the store.
+    Returns a (success, result) tuple, where result is the list of store
+    entries on success and an error message otherwise.
+    """
+    os.makedirs(get_wheel_store_dir(), exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="dependency_guesser_") as wheel_dir:
+        try:
+            subprocess.run(
+                [python_executable, "-m", "pip", "wheel", "--wheel-dir", wheel_dir]
+                + get_index_args([requirement])
+                + [requirement],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+        except subprocess.CalledProcessError as e:
+            error_message = f"Failed to build wheels for '{requirement}'.\n"
+            error_message += f"pip exited with status {e.returncode}.\n"
+            error_message += f"Stderr:\n{e.stderr}"
+            return False, error_message
+        wheels = sorted(glob.glob(os.path.join(wheel_dir, "*.whl")))
+        return True, [add_wheel_to_store(path) for path in wheels]
+
+
+def get_record_hash(data) -> str:
+    """
+    Returns the RECORD hash field of some file contents.
+    """
+    digest = hashlib.sha256(data).digest()
+    return "sha256=" + base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def link_wheel_tree(entry, info, python_executable):
+    """
+    Installs a stored wheel into the interpreter described by info by
+    hardlinking its unpacked files, generating its console scripts and
+    writing fresh INSTALLER and RECORD files. Files that have to be changed
+    (scripts with a '#!python' shebang, the metadata written here) are new
+    files, never the linked ones, so the store itself is left untouched.
+    """
+    tree = os.path.join(get_wheel_store_dir(), entry["sha256"], "tree")
+    dist_info = next(name for name in os.listdir(tree) if name.endswith(".dist-info"))
+    data_dir = dist_info[: -len(".dist-info")] + ".data"
+    wheel_metadata = read_text_or_none(os.path.join(tree, dist_info, "WHEEL")) or ""
+    purelib = re.search(r"^Root-Is-Purelib:\s*true", wheel_metadata, re.M | re.I)
+    paths = info["paths"]
+    root_dir = paths["purelib"] if purelib else paths["platlib"]
+    version = ".".join(str(part) for part in info["version"])
+    schemes = {
+        "purelib": paths["purelib"],
+        "platlib": paths["platlib"],
+        "scripts": paths["scripts"],
+        "data": paths["data"],
+        "headers": os.path.join(
+            paths["data"], "include", "site", f"python{version}", entry["name"]
+        ),
+    }
+
+    record_text = read_text_or_none(os.path.join(tree, dist_info, "RECORD")) or ""
+    record = {row[0]: row[1:3] for row in csv.reader(record_text.splitlines()) if row}
+    skipped = {f"{dist_info}/{name}" for name in ("RECORD", "INSTALLER", "REQUESTED")}
+    installed = []  # (path, hash, size) rows of the new RECORD
+
+    def write_new_file(path, data, mode=0o644):
+        if os.path.lexists(path):
+            os.unlink(path)  # It may be a hardlink into the store
+        with open(path, "wb") as f:
+            f.write(data)
+        os.chmod(path, mode)
+        installed.append((path, get_record_hash(data), str(len(data))))
+
+    for root, _, files in os.walk(tree):
+        for name in files:
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, tree).replace(os.sep, "/")
+            if relative in skipped:
+                continue
+            parts = relative.split("/")
+            if parts[0] == data_dir:
+                target = os.path.join(schemes[parts[1]], *parts[2:])
+            else:
+                target = os.path.join(root_dir, *parts)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            if parts[0] == data_dir and parts[1] == "scripts":
+                with open(source, "rb") as f:
+                    data = f.read()
+                if data.startswith(b"#!python"):
+                    data = b"#!" + os.fsencode(python_executable) + data[8:]
+                write_new_file(target, data, 0o755)
+                continue
+            if os.path.lexists(target):
+                os.unlink(target)
+            clone_file(source, target)
+            file_hash, size = record.get(relative) or ("", "")
+            if not file_hash:
+                with open(source, "rb") as f:
+                    data = f.read()
+                file_hash, size = get_record_hash(data), str(len(data))
+            installed.append((target, file_hash, size))
+
+    entry_points = configparser.ConfigParser(delimiters=("=",), interpolation=None)
+    entry_points.read_string(
+        read_text_or_none(os.path.join(tree, dist_info, "entry_points.txt")) or ""
+    )
+    for section in ("console_scripts", "gui_scripts"):
+        if not entry_points.has_section(section):
+            continue
+        for script_name, value in entry_points.items(section):
+            module, _, call = value.partition(":")
+            call = call.split("[")[0].strip() or "main"
+            script = CONSOLE_SCRIPT_TEMPLATE.format(
+                python=python_executable,
+                module=module.strip(),
+                import_name=call.split(".")[0],
+                call=call,
+            )
+            os.makedirs(paths["scripts"], exist_ok=True)
+            write_new_file(
+                os.path.join(paths["scripts"], script_name), script.encode(), 0o755
+            )
+
+    dist_info_dir = os.path.join(root_dir, dist_info)
+    write_new_file(
+        os.path.join(dist_info_dir, "INSTALLER"), f"{WHEEL_STORE_INSTALLER}\n".encode()
+    )
+    rows = [
+        [os.path.relpath(path, root_dir).replace(os.sep, "/"), file_hash, size]
+        for path, file_hash, size in installed
+    ]
+    rows.append([f"{dist_info}/RECORD", "", ""])
+    record_path = os.path.join(dist_info_dir, "RECORD")
+    if os.path.lexists(record_path):
+        os.unlink(record_path)
+    with open(record_path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def get_installed_versions(python_executable) -> dict:
+    """
+    Maps the normalized names of the distributions visible to an interpreter to their versions.
+    """
+    versions = {}
+    for requirement in get_interpreter_snapshot(python_executable)["distributions"]:
+        name, _, version = requirement.partition("==")
+        versions[normalize_distribution_name(name)] = version
+    return versions
+
+
+def install_from_wheel_store(pip_args, python_executable):
+    """
+    Installs requirements by hardlinking their wheels from the store, running
+    'pip wheel' only for requirements whose closure was never built for this
+    interpreter. Returns a (success, output) tuple like run_pip_install, or
+    None when the request has to go through pip instead: options such as
+    --upgrade, Windows (console scripts need .exe launchers), or a different
+    version of a dependency already being installed.
+    """
+    if sys.platform == "win32" or any(arg.startswith("-") for arg in pip_args):
+        return None
+    try:
+        info = get_interpreter_snapshot(python_executable)
+        installed_versions = get_installed_versions(python_executable)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        logging.debug(f"Not using the wheel store: {e}")
+        return None
+
+    closures = load_wheel_closures().get(info["tag"], {})
+    wheels = {}
+    for requirement in pip_args:
+        closure = closures.get(requirement)
+        if closure is None or not all(
+            os.path.isdir(os.path.join(get_wheel_store_dir(), wheel["sha256"], "tree"))
+            for wheel in closure
+        ):
+            logging.info(f"Building wheels for '{requirement}'...")
+            success, closure = build_wheel_closure(requirement, python_executable)
+            if not success:
+                return False, closure
+            record_wheel_closure(info["tag"], requirement, closure)
+        for wheel in closure:
+            wheels[normalize_distribution_name(wheel["name"])] = wheel
+
+    to_link = []
+    for name, wheel in wheels.items():
+        installed_version = installed_versions.get(name)
+        if installed_version is None:
+            to_link.append(wheel)
+        elif installed_version != wheel["version"]:
+            logging.debug(
+                f"'{name}' {installed_version} is installed, but the store has {wheel['version']}."
+            )
+            return None
+
+    try:
+        with lock_environment(python_executable, exclusive=True):
+            for wheel in to_link:
+                link_wheel_tree(wheel, info, python_executable)
+    except (OSError, KeyError, StopIteration) as e:
+        logging.warning(f"Linking from the wheel store failed, using pip: {e}")
+        return None
+    if not to_link:
+        return True, f"Requirement already satisfied: {' '.join(pip_args)}"
+    linked = " ".join(f"{wheel['name']}-{wheel['version']}" for wheel in to_link)
+    return True, f"Linked from the wheel store: {linked}"
+
+
+def run_pip_worker_install(pip_args, python_executable, cwd=None):
+    """
+    Runs 'pip install' in the environment's persistent pip worker.
+    Returns a (success, output) tuple.
+    """
+    return run_pip("install", pip_args, python_executable, cwd, use_worker=True)
+
+
+def run_pip_worker_dry_run(pip_args, python_executable, cwd=None):
+    """
+    Runs 'pip install --dry-run' in the environment's persistent pip worker.
+    Returns a (success, output) tuple.
+    """
+    return run_pip(
+        "install",
+        ["--dry-run"] + pip_args,
+        python_executable,
+        cwd,
+        exclusive=False,
+        use_worker=True,
+    )
+
+
+def run_pip_worker_uninstall(distribution_names, python_executable):
+    """
+    Runs 'pip uninstall' in the environment's persistent pip worker.
+    Returns a (success, output) tuple.
+    """
+    return run_pip(
+        "uninstall", ["-y"] + distribution_names, python_executable, use_worker=True
+    )
+
+
+def install_with_wheel_store(pip_args, python_executable, cwd=None):
+    """
+    Installs through the wheel store when it can handle pip_args, and with
+    'pip install' otherwise. Returns a (success, output) tuple.
+    """
+    if cwd is None:
+        result = install_from_wheel_store(pip_args, python_executable)
+        if result is not None:
+            return result
+    return run_pip_install(pip_args, python_executable, cwd)
+
+
+@dataclass(frozen=True)
+class InstallerBackend:
+    """
+    A way of installing distributions into an environment.
+    install and dry_run take (pip_args, python_executable, cwd) and uninstall
+    takes (distribution_names, python_executable); all three return a
+    (success, output) tuple. installed takes python_executable and returns a
+    dict mapping normalized distribution names to versions.
+    """
+
+    name: str
+    install: Callable
+    dry_run: Callable = run_pip_dry_run
+    uninstall: Callable = run_pip_uninstall
+    installed: Callable = get_installed_versions
+
+
+INSTALLER_ENTRY_POINT_GROUP = "dependency_guesser.installers"
+
+INSTALLER_BACKENDS = {
+    "pip": InstallerBackend("pip", run_pip_install),
+    "pip-worker": InstallerBackend(
+        "pip-worker",
+        run_pip_worker_install,
+        run_pip_worker_dry_run,
+        run_pip_worker_uninstall,
+    ),
+    "wheel-store": InstallerBackend("wheel-store", install_with_wheel_store),
+}
+installer_plugins_loaded = False
+
+# Set from the command line
+installer_backend = "pip"
+
+
+def register_installer_backend(backend):
+    """
+    Adds an installer backend to the registry, so it can be selected with --installer.
+    """
+    if not isinstance(backend, InstallerBackend):
+        raise TypeError(f"Expected an InstallerBackend, got {type(backend).__name__}.")
+    INSTALLER_BACKENDS[backend.name] = backend
+
+
+def load_installer_plugins():
+    """
+    Registers the installer backends contributed through the entry point group,
+    skipping (and logging) the broken ones like load_classifier_plugins does.
+    """
+    global installer_plugins_loaded
+    if installer_plugins_loaded:
+        return
+    installer_plugins_loaded = True
+
+    for entry_point in iter_entry_points(INSTALLER_ENTRY_POINT_GROUP):
+        try:
+            contributed = entry_point.load()
+            if isinstance(contributed, InstallerBackend):
+                contributed = [contributed]
+            for backend in contributed:
+                register_installer_backend(backend)
+        except Exception as e:
+            logging.warning(f"Ignoring installer plugin '{entry_point.name}': {e}")
+
+
+def get_installer_backend() -> InstallerBackend:
+    """
+    Returns the installer backend selected for this run.
+    """
+    load_installer_plugins()
+    return INSTALLER_BACKENDS[installer_backend]
+
+
+def run_install(pip_args, python_executable, cwd=None):
+    """
+    Installs pip_args with the selected installer backend. In offline mode,
+    requirements the wheelhouse does not have fail right away.
+    Returns a (success, output) tuple.
+    """
+    missing = find_missing_from_wheelhouse(pip_args)
+    if missing:
+        # Offline, pip could only fail; say so without running it
+        return False, f"Not in the wheelhouse '{wheelhouse_dir}': {', '.join(missing)}"
+    return get_installer_backend().install(pip_args, python_executable, cwd)
+
+
+def install_package(
+    package_name, python_executable, assume_yes=False, upgrade=False, distribution=False
+):
+    """
+    Installs a given package using pip into the specified python environment.
+    Prompts the user for confirmation unless assume_yes is True.
+    The name is mapped through the aliases unless it is already a distribution
+    requirement (distribution=True), and is upgraded in place if upgrade is True.
+    """
+    if not package_name:
+        return False, "No package name provided."
+
+    verb = "upgrade" if upgrade else "install"
+    if not assume_yes and not confirm_install([package_name], upgrade):
+        logging.warning(f"Skipping {verb} of '{package_name}'.")
+        return False, f"User declined to {verb} {package_name}."
+
+    logging.info(f"Attempting to {verb} '{package_name}' with {installer_backend}...")
+    if distribution:
+        pip_args, cwd = [package_name], None
+    else:
+        pip_args, cwd = get_pip_args(package_name)
+    if upgrade:
+        pip_args = ["--upgrade"] + pip_args
+    success, output = run_install(pip_args, python_executable, cwd)
+    if not success:
+        return False, output
+    learn_installed_modules(pip_args, python_executable)
+    logging.info(
+        f"Successfully {'upgraded' if upgrade else 'installed'} '{package_name}'."
+    )
+    print(output)
+    return True, ""
+
+
+def install_packages(package_names, python_executable, assume_yes=False):
+    """
+    Installs several packages with as few pip invocations as possible.
+    Packages are grouped by the directory pip must run from (editable '.' aliases
+    carry their own cwd) and each group is installed with a single pip call. If a
+    group fails, its packages are retried one by one to isolate the culprit.
+    Modules already provided by a distribution installed into the same
+    environment in this run are skipped.
+    Returns an (installed, failures) tuple, where failures maps package names to
+    error messages.
+    """
+    satisfied = get_satisfied_modules(python_executable)
+    package_names = [
+        name for name in dict.fromkeys(package_names) if name and name not in satisfied
+    ]
+    if not package_names:
+        return [], {}
+
+    if not assume_yes and not confirm_install(package_names):
+        logging.warning(f"Skipping installation of {package_names}.")
+        return [], {name: f"User declined to install {name}." for name in package_names}
+
+    installed = []
+    failures = {}
+    groups = {}
+    for package_name in package_names:
+        pip_args, cwd = get_pip_args(package_name)
+        missing = find_missing_from_wheelhouse(pip_args)
+        if missing:
+            # Kept out of the batch so the rest can still go in one call
+            failures[package_name] = (
+                f"Not in the wheelhouse '{wheelhouse_dir}': {', '.join(missing)}"
+            )
+            continue
+        groups.setdefault(cwd, []).append((package_name, pip_args))
+
+    learned_args = []
+    for cwd, entries in groups.items():
+        # Several modules may map to the same distribution or editable project
+        batch_args = list(dict.fromkeys(tuple(args) for _, args in entries))
+        names = [name for name, _ in entries]
+        logging.info(f"Attempting to install {names} with {installer_backend}...")
+        success, output = run_install(
+            [arg for args in batch_args for arg in args], python_executable, cwd
+        )
+        if success:
+            logging.info(f"Successfully installed {names}.")
+            print(output)
+            installed.extend(names)
+            learned_args.extend(arg for args in batch_args for arg in args)
+            continue
+        if len(batch_args) == 1:
+            failures.update({name: output for name in names})
+            continue
+
+        logging.warning("Batch install failed; retrying packages one at a time.")
+        for package_name, pip_args in entries:
+            success, output = run_install(pip_args, python_executable, cwd)
+            if success:
+                logging.info(f"Successfully installed '{package_name}'.")
+                print(output)
+                installed.append(package_name)
+                learned_args.extend(pip_args)
+            else:
+                failures[package_name] = output
+
+    learn_installed_modules(learned_args, python_executable)
+    return installed, failures
+
+
+def print_summary(installed_packages):
+    """
+    Prints the list of packages installed while resolving a script.
+    """
+    print("\n--- Dependency Resolution Summary ---")
+    if installed_packages:
+        print("Successfully installed the following packages:")
+        for pkg in installed_packages:
+            print(f"  - {pkg}")
+    else:
+        print("No new packages needed to be installed.")
+    print("---------------------------------------")
+
+
+# Upper bound on scripts run at the same time by the asynchronous API
+MAX_CONCURRENT_PROBES = os.cpu_count() or 1
+
+# asyncio primitives are bound to one event loop, so they are kept per loop
+loop_states = weakref.WeakKeyDictionary()
+
+
+def get_loop_state():
+    """
+    Returns the probe semaphore and per-environment install locks of the running loop.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in loop_states:
+        loop_states[loop] = {
+            "probe_semaphore": asyncio.Semaphore(MAX_CONCURRENT_PROBES),
+            "install_locks": {},
+        }
+    return loop_states[loop]
+
+
+def get_install_lock(python_executable):
+    """
+    Returns the lock serializing installs into the environment of python_executable.
+    """
+    environment = get_environment_path(python_executable)
+    return get_loop_state()["install_locks"].setdefault(environment, asyncio.Lock())
+
+
+@dataclass
+class Resolution:
+    """
+    Outcome of resolving one script.
+    status is one of 'resolved', 'cached', 'unconfirmed' (timed out while still
+    importing), 'failed' (an error that installing cannot fix), 'unresolved'
+    (retry limit reached) or 'aborted' (an install or the interpreter failed).
+    """
+
+    status: str
+    installed_packages: list = field(default_factory=list)
+    detail: str = ""
+
+
+@dataclass(frozen=True)
+class Remedy:
+    """
+    What to install to fix a classified import failure: a module name (mapped
+    through the aliases) or, with distribution, a requirement, either of which
+    may have to be upgraded instead of installed.
+    """
+
+    package_name: str
+    upgrade: bool = False
+    distribution: bool = False
+
+
+def get_remedy(failure, python_executable) -> Remedy:
+    """
+    Maps a classified import failure to what has to be installed to fix it.
+    A missing dotted module is resolved to the name of its distribution, and a
+    module missing a name is upgraded as a whole package.
+    """
+    package_name = failure.target
+    if failure.action == UPGRADE_MODULE:
+        package_name = package_name.split(".")[0]
+    elif failure.action == INSTALL_MODULE:
+        if failure.filename and failure.lineno:
+            package_name = find_imported_name(
+                failure.filename, failure.lineno, package_name
+            )
+        package_name = resolve_dotted_module(package_name, python_executable)
+    return Remedy(
+        package_name,
+        upgrade=failure.action in (UPGRADE_MODULE, UPGRADE_DISTRIBUTION),
+        distribution=failure.action in (INSTALL_DISTRIBUTION, UPGRADE_DISTRIBUTION),
+    )
+
+
+async def run_limited(script_path, timeout, python_executable, **kwargs):
+    """
+    Runs the script via run_script_async, waiting for a free probe slot first.
+    """
+    async with get_loop_state()["probe_semaphore"]:
+        return await run_script_async(script_path, timeout, python_executable, **kwargs)
+
+
+async def install_locked(package_names, python_executable, assume_yes, **kwargs):
+    """
+    Installs one package (a string) or a batch of packages (a list) while holding
+    the environment's install lock, with pip running in a worker thread.
+    """
+    async with get_install_lock(python_executable):
+        if isinstance(package_names, str):
+            return await asyncio.to_thread(
+                install_package, package_names, python_executable, assume_yes, **kwargs
+            )
+        return await asyncio.to_thread(
+            install_packages, package_names, python_executable, assume_yes
+        )
+
+
+class Prefetcher:
+    """
+    Downloads the distributions of modules that are expected to be missing in
+    the background with 'pip download', while the script runs, so installing
+    them later only has to unpack local files. Each requirement's closure is
+    downloaded into a private directory, and installs of requirements whose
+    closure is complete there are pointed at it instead of the index.
+    """
+
+    def __init__(self, python_executable):
+        self.python_executable = python_executable
+        self.download_dir = tempfile.mkdtemp(prefix="dependency_guesser_prefetch_")
+        self.downloads = {}  # requirement -> task downloading it
+        # One pip at a time, so downloads do not starve the script runs of CPU
+        self.lock = asyncio.Lock()
+        prefetched[self.download_dir] = set()
+
+    def get_requirement(self, module_name):
+        pip_args, cwd = get_pip_args(module_name)
+        # Editable projects are local anyway
+        return None if cwd or pip_args[0] == "-e" else pip_args[0]
+
+    def start(self, module_names):
+        """
+        Starts downloading the distributions providing the given modules.
+        """
+        requirements = []
+        for requirement in map(self.get_requirement, module_names):
+            if requirement and requirement not in self.downloads:
+                requirements.append(requirement)
+        if requirements:
+            task = asyncio.ensure_future(self.download(requirements))
+            self.downloads.update(dict.fromkeys(requirements, task))
+
+    async def run_pip_download(self, requirements):
+        process = await asyncio.create_subprocess_exec(
+            self.python_executable,
+            "-m",
+            "pip",
+            "download",
+            "--dest",
+            self.download_dir,
+            *get_index_args(),
+            *requirements,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            return await process.wait() == 0
+        except asyncio.CancelledError:
+            process.kill()
+            # It must not write into the download directory once that is removed
+            await process.wait()
+            raise
+
+    async def download(self, requirements):
+        """
+        Downloads the requirements with a single pip call, falling back to one
+        call per requirement if that fails, so one bad guess does not spoil the rest.
+        """
+        async with self.lock:
+            start = time.monotonic()
+            if await self.run_pip_download(requirements):
+                done = requirements
+            else:
+                done = []
+                for requirement in requirements if len(requirements) > 1 else []:
+                    if await self.run_pip_download([requirement]):
+                        done.append(requirement)
+            prefetched[self.download_dir].update(done)
+            logging.debug(
+                f"Prefetched {done} of {requirements} in {time.monotonic() - start:.2f}s."
+            )
+
+    async def wait(self, module_names):
+        """
+        Waits until the downloads of the given modules (if started) are done.
+        """
+        tasks = [
+            self.downloads[requirement]
+            for requirement in map(self.get_requirement, module_names)
+            if requirement in self.downloads
+        ]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self):
+        """
+        Cancels the downloads still running, waits for their pip processes to be
+        gone and removes the downloaded files.
+        """
+        tasks = set(self.downloads.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        prefetched.pop(self.download_dir, None)
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+
+
+async def resolve_dependencies_async(
+    script_path,
+    timeout,
+    assume_yes,
+    python_executable,
+    prescan=True,
+    probe=False,
+    import_idle_ms=0,
+    capture_limit=DEFAULT_CAPTURE_LIMIT,
+    output_log=None,
+    use_cache=True,
+    prefetch=False,
+):
+    """
+    Main loop to run the script, catch import errors, and install dependencies,
+    as a coroutine that returns a Resolution. Runs of the script share a
+    semaphore limiting how many run at once, and installs into the same
+    environment are serialized, so many scripts can be resolved concurrently.
+    When prescan is enabled, statically detected imports are installed before the
+    first run, and when probe is enabled a single stubbed run collects every
+    remaining missing import, so the loop usually only has to verify the result.
+    With import_idle_ms set, runs are stopped as soon as the script's import
+    phase has been idle for that long instead of waiting for the timeout.
+    Only the last capture_limit bytes of the script's output are kept in memory;
+    output_log receives the complete output of every run.
+    With use_cache, a script that was already resolved in an unchanged
+    environment returns immediately without being run.
+    With prefetch, the distributions of statically detected missing imports are
+    downloaded in the background while the probe or the runs execute. Installs
+    after the probe wait for those downloads; installs in the loop use them
+    only once they are complete, rather than waiting.
+    """
+    installed_packages = []
+    upgraded_packages = set()
+    max_retries = 20  # A safe limit to prevent infinite loops
+    retries = 0
+    resolution = None
+
+    if use_cache:
+        key = await asyncio.to_thread(
+            get_resolution_key, script_path, python_executable
+        )
+        if key and key in load_resolution_cache():
+            logging.info(
+                f"'{script_path}' is already resolved in this environment; nothing to do."
+            )
+            return Resolution("cached", installed_packages)
+
+    prefetcher = None
+    try:
+        static_missing = []
+        if prescan or prefetch:
+            static_missing = await asyncio.to_thread(
+                prescan_dependencies, script_path, python_executable
+            )
+            if static_missing:
+                logging.info(f"Statically detected missing modules: {static_missing}")
+        # Only worth it when installing is deferred past a probe or a run
+        if prefetch and static_missing and (probe or not prescan):
+            prefetcher = Prefetcher(python_executable)
+            prefetcher.start(static_missing)
+
+        # With a probe coming, the pre-scan results are installed together with the
+        # probe's, so the downloads overlap with the probe run
+        if prescan and not prefetcher:
+            installed, failures = await install_locked(
+                static_missing, python_executable, assume_yes
+            )
+            installed_packages.extend(installed)
+            for message in failures.values():
+                # A static guess may be wrong; the run below is the source of truth
+                logging.warning(f"Pre-scan install skipped: {message}")
+
+        if probe:
+            async with get_loop_state()["probe_semaphore"]:
+                missing_modules = await probe_missing_modules(
+                    script_path, timeout, python_executable, import_idle_ms
+                )
+            missing_modules = [
+                await asyncio.to_thread(resolve_dotted_module, name, python_executable)
+                for name in missing_modules
+            ]
+            if missing_modules:
+                logging.info(f"Probe detected missing modules: {missing_modules}")
+            if prescan and prefetcher:
+                missing_modules = list(dict.fromkeys(static_missing + missing_modules))
+            if prefetcher:
+                await prefetcher.wait(missing_modules)
+            installed, failures = await install_locked(
+                missing_modules, python_executable, assume_yes
+            )
+            installed_packages.extend(installed)
+            for message in failures.values():
+                logging.warning(f"Probe install skipped: {message}")
+
+        while retries < max_retries:
+            retries += 1
+            logging.info(
+                f"--- Attempt {retries}: Running '{script_path}' using '{python_executable}' ---"
+            )
+            try:
+                # Execute the target script as a subprocess using the correct interpreter
+                process = await run_limited(
+                    script_path,
+                    timeout,
+                    python_executable,
+                    import_idle_ms=import_idle_ms,
+                    capture_limit=capture_limit,
+                    output_log=output_log,
+                )
+            except FileNotFoundError:
+                logging.critical(
+                    f"Error: The script '{script_path}' or interpreter '{python_executable}' was not found."
+                )
+                return Resolution("aborted", installed_packages, "not found")
+            except Exception as e:
+                logging.critical(f"An unexpected error occurred: {e}")
+                return Resolution("aborted", installed_packages, str(e))
+
+            # Check stderr for import errors, which may have been spotted while the
+            # script was still running
+            stderr_output = process.stderr
+            failure = process.import_failure
+            if failure is None and process.returncode != 0 and stderr_output:
+                failure = parse_import_failure(stderr_output)
+            if failure:
+                remedy = await asyncio.to_thread(get_remedy, failure, python_executable)
+                package_to_install = remedy.package_name
+                upgrade = remedy.upgrade
+                location = ""
+                if failure.filename:
+                    location = f" (at {failure.filename}:{failure.lineno})"
+                logging.info(
+                    f"Detected {failure.classifier} failure: '{failure.target}'{location}"
+                )
+
+                if (
+                    failure.action == INSTALL_MODULE
+                    and package_to_install in get_satisfied_modules(python_executable)
+                ):
+                    logging.error(
+                        f"'{package_to_install}' is still missing although the distribution providing it was installed."
+                    )
+                    print(f"\n--- STDERR ---\n{stderr_output}")
+                    resolution = Resolution(
+                        "failed", installed_packages, failure.target
+                    )
+                    break
+
+                if upgrade and package_to_install in upgraded_packages:
+                    logging.error(
+                        f"Upgrading '{package_to_install}' did not resolve the failure."
+                    )
+                    print(f"\n--- STDERR ---\n{stderr_output}")
+                    resolution = Resolution(
+                        "failed", installed_packages, failure.target
+                    )
+                    break
+
+                success, message = await install_locked(
+                    package_to_install,
+                    python_executable,
+                    assume_yes,
+                    upgrade=upgrade,
+                    distribution=remedy.distribution,
+                )
+                if success:
+                    if upgrade:
+                        upgraded_packages.add(package_to_install)
+                    installed_packages.append(package_to_install)
+                    continue
+                else:
+                    logging.error(f"Error: {message}")
+                    logging.critical("Aborting due to installation failure.")
+                    return Resolution("aborted", installed_packages, message)
+
+            if process.imports_completed:
+                logging.info("--- Script Import Phase Completed ---")
+                logging.info(
+                    "The script finished importing without any import errors and was stopped."
+                )
+                # Not cached: a later import may still fail
+                resolution = Resolution(
+                    "resolved", installed_packages, "stopped once its imports went idle"
+                )
+                print(f"\n--- STDOUT ---\n{process.stdout}")
+                if process.stderr:
+                    print(f"\n--- STDERR ---\n{process.stderr}")
+                break
+
+            if process.timed_out:
+                logging.warning("--- Script Execution Timed Out ---")
+                logging.warning(
+                    f"The script ran for more than the specified timeout of {timeout} seconds without exiting."
+                )
+                if import_idle_ms:
+                    logging.warning(
+                        "Its imports were still running, so the dependencies could not be confirmed."
+                    )
+                    resolution = Resolution("unconfirmed", installed_packages)
+                else:
+                    logging.info("Assuming all dependencies are resolved.")
+                    # Not cached: the assumption is not worth remembering
+                    resolution = Resolution("resolved", installed_packages, "timed out")
+                break
+
+            if process.returncode != 0 and stderr_output:
+                logging.error(
+                    "Script failed with an error that is not a recognized import error."
+                )
+                logging.error(f"Return Code: {process.returncode}")
+                print(f"\n--- STDOUT ---\n{process.stdout}")
+                print(f"\n--- STDERR ---\n{stderr_output}")
+                resolution = Resolution(
+                    "failed",
+                    installed_packages,
+                    f"exited with status {process.returncode}",
+                )
+                break
+
+            logging.info("--- Script Execution Successful ---")
+            logging.info("The script ran without any import errors.")
+            resolution = Resolution("resolved", installed_packages)
+            print(f"\n--- STDOUT ---\n{process.stdout}")
+            if process.stderr:
+                print(f"\n--- STDERR ---\n{process.stderr}")
+            break
+
+        if resolution is None:
+            logging.critical(
+                "Reached maximum number of retries. Aborting to prevent infinite loop."
+            )
+            return Resolution("unresolved", installed_packages)
+
+        if resolution.status == "resolved" and not resolution.detail and use_cache:
+            # Installs changed the environment, so its fingerprint is taken afresh
+            key = await asyncio.to_thread(
+                get_resolution_key, script_path, python_executable
+            )
+            if key:
+                record_resolutions({key: script_path})
+
+        return resolution
+    finally:
+        if prefetcher:
+            await prefetcher.close()
+
+
+def resolve_dependencies(script_path, timeout, assume_yes, python_executable, **kwargs):
+    """
+    Synchronous entry point of the resolver used by the CLI. Takes the same
+    arguments as resolve_dependencies_async, prints the summary and exits the
+    program if the resolution had to be aborted.
+    """
+    resolution = asyncio.run(
+        resolve_dependencies_async(
+            script_path, timeout, assume_yes, python_executable, **kwargs
+        )
+    )
+    if resolution.status == "aborted":
+        sys.exit(1)
+    print_summary(resolution.installed_packages)
+    return resolution
+
+
+# Characters that make a script argument a glob pattern rather than a path
+GLOB_CHARACTERS = "*?["
+
+
+def expand_script_paths(script_path=None, manifest=None):
+    """
+    Expands a directory (all *.py files below it, skipping virtual environments
+    and hidden directories), a glob pattern or a single path, plus an optional
+    manifest file listing one path or pattern per line ('#' starts a comment),
+    into a sorted list of script paths.
+    """
+    patterns = []
+    if script_path:
+        patterns.append(script_path)
+    if manifest:
+        with open(manifest, "r") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    # Relative entries are relative to the manifest itself
+                    patterns.append(
+                        os.path.join(os.path.dirname(os.path.abspath(manifest)), line)
+                    )
+
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                # Installed packages are not scripts of the project
+                dirs[:] = [
+                    d
+                    for d in dirs
+                    if not d.startswith(".")
+                    and d not in ("__pycache__", "site-packages", "node_modules")
+                    and not os.path.exists(os.path.join(root, d, "pyvenv.cfg"))
+                ]
+                paths.update(os.path.join(root, f) for f in files if f.endswith(".py"))
+        elif any(char in pattern for char in GLOB_CHARACTERS):
+            paths.update(glob.glob(pattern, recursive=True))
+        else:
+            paths.add(pattern)
+    return sorted(paths)
+
+
+def scan_imports_or_empty(script_path):
+    """
+    Like scan_imports, but returns an empty set for scripts that cannot be parsed,
+    so a single broken file does not stop a parallel scan.
+    """
+    try:
+        return scan_imports(script_path)
+    except (OSError, SyntaxError, ValueError):
+        return set()
+
+
+def hash_file(path):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def resolve_batch(
+    script_paths,
+    timeout,
+    assume_yes,
+    python_executable,
+    jobs=None,
+    prescan=True,
+    probe=False,
+    import_idle_ms=0,
+    capture_limit=DEFAULT_CAPTURE_LIMIT,
+    use_cache=True,
+):
+    """
+    Resolves many scripts against one environment and returns a dict mapping
+    each script path to a (status, detail) tuple.
+    Identical files are resolved once. Imports are scanned in parallel processes
+    and the union of missing modules is installed in one batch; with probe, every
+    script is then probed with stubbed imports and what the probes found missing
+    is installed in a second batch. The scripts are then verified concurrently
+    with up to `jobs` runs at a time. Failures left after a verification round
+    are again installed together before the affected scripts are re-run.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    results = {}
+    representatives = {}  # duplicate path -> path of the identical file resolved
+    unique_paths = {}
+    for path in script_paths:
+        try:
+            digest = hash_file(path)
+        except OSError as e:
+            results[path] = ("error", f"cannot read script: {e}")
+            continue
+        representatives[path] = unique_paths.setdefault(digest, path)
+    pending = list(unique_paths.values())
+
+    if use_cache and pending:
+        try:
+            environment_hash = get_interpreter_snapshot(python_executable)[
+                "fingerprint"
+            ]
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            environment_hash = None
+        cache = load_resolution_cache() if environment_hash else {}
+        for path in list(pending):
+            if get_resolution_key(path, python_executable, environment_hash) in cache:
+                results[path] = ("cached", "already resolved in this environment")
+                pending.remove(path)
+
+    installed_packages = []
+    attempted = set()  # remedies that were already tried
+    if prescan and pending:
+        logging.info(f"Scanning imports of {len(pending)} scripts...")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            scans = list(pool.map(scan_imports_or_empty, pending, chunksize=16))
+        missing_modules = find_missing_imports(
+            dict(zip(pending, scans)), python_executable
+        )
+        if missing_modules:
+            logging.info(
+                f"Statically detected missing modules: {sorted(missing_modules)}"
+            )
+        installed, failures = install_packages(
+            sorted(missing_modules), python_executable, assume_yes
+        )
+        installed_packages.extend(installed)
+        for message in failures.values():
+            logging.warning(f"Pre-scan install skipped: {message}")
+        # Installing these already failed once; the runs only need to confirm it
+        attempted.update(Remedy(name) for name in failures)
+
+    if probe and pending:
+
+        async def probe_all(paths):
+            semaphore = asyncio.Semaphore(jobs)
+
+            async def run(path):
+                async with semaphore:
+                    try:
+                        return await probe_missing_modules(
+                            path, timeout, python_executable, import_idle_ms
+                        )
+                    except FileNotFoundError:
+                        return []
+
+            return await asyncio.gather(*(run(path) for path in paths))
+
+        logging.info(f"Probing {len(pending)} scripts...")
+        probed = set().union(*asyncio.run(probe_all(pending)))
+        missing_modules = {
+            resolve_dotted_module(name, python_executable) for name in probed
+        }
+        if missing_modules:
+            logging.info(f"Probes detected missing modules: {sorted(missing_modules)}")
+        installed, failures = install_packages(
+            sorted(missing_modules), python_executable, assume_yes
+        )
+        installed_packages.extend(installed)
+        for message in failures.values():
+            logging.warning(f"Probe install skipped: {message}")
+        attempted.update(Remedy(name) for name in failures)
+
+    async def verify(paths):
+        semaphore = asyncio.Semaphore(jobs)
+
+        async def run(path):
+            async with semaphore:
+                try:
+                    return await run_script_async(
+                        path,
+                        timeout,
+                        python_executable,
+                        import_idle_ms,
+                        capture_limit=capture_limit,
+                    )
+                except FileNotFoundError:
+                    return None
+
+        return await asyncio.gather(*(run(path) for path in paths))
+
+    max_rounds = 20  # Same safety limit as the single-script loop
+    for round_number in range(1, max_rounds + 1):
+        if not pending:
+            break
+        logging.info(f"--- Round {round_number}: verifying {len(pending)} scripts ---")
+        runs = dict(zip(pending, asyncio.run(verify(pending))))
+
+        failing = {}  # remedy -> scripts whose failure it fixes
+        for path, run in runs.items():
+            if run is None:
+                results[path] = (
+                    "error",
+                    f"interpreter '{python_executable}' not found",
+                )
+                continue
+            failure = run.import_failure
+            if failure is None and run.returncode != 0 and run.stderr:
+                failure = parse_import_failure(run.stderr)
+            if failure:
+                remedy = get_remedy(failure, python_executable)
+                if remedy in attempted:
+                    results[path] = (
+                        "unresolved",
+                        f"{failure.classifier}: {failure.target}",
+                    )
+                else:
+                    failing.setdefault(remedy, []).append(path)
+            elif run.imports_completed:
+                results[path] = ("resolved", "stopped once its imports went idle")
+            elif run.returncode == 0 and not run.timed_out:
+                results[path] = ("resolved", "")
+            elif run.timed_out:
+                status = "unconfirmed" if import_idle_ms else "resolved"
+                results[path] = (status, f"timed out after {timeout} seconds")
+            else:
+                results[path] = ("failed", f"exited with status {run.returncode}")
+
+        pending = []
+        attempted.update(failing)
+        # Plain module installs go in one batch
+        modules = [
+            remedy.package_name
+            for remedy in failing
+            if not remedy.upgrade and not remedy.distribution
+        ]
+        installed, failures = install_packages(modules, python_executable, assume_yes)
+        installed_packages.extend(installed)
+        for remedy, paths in failing.items():
+            target = remedy.package_name
+            if remedy.upgrade or remedy.distribution:
+                success, message = install_package(
+                    target,
+                    python_executable,
+                    assume_yes,
+                    upgrade=remedy.upgrade,
+                    distribution=remedy.distribution,
+                )
+                if success:
+                    installed_packages.append(target)
+                else:
+                    failures[target] = message
+            if target in failures:
+                for path in paths:
+                    results[path] = ("failed", f"could not install '{target}'")
+            else:
+                pending.extend(paths)
 
-    with open(aliases_file, "r") as f:
+    for path in pending:
+        results[path] = ("unresolved", "reached the maximum number of rounds")
+
+    if use_cache:
+        # Timed out or stopped runs are assumptions, not worth remembering
+        resolved = [
+            path for path in unique_paths.values() if results[path] == ("resolved", "")
+        ]
         try:
-            return json.load(f)
-        except json.JSONDecodeError as e:
-            logging.error(f"Failed to parse aliases file: {e}")
-            return {}
+            environment_hash = get_interpreter_snapshot(python_executable)[
+                "fingerprint"
+            ]
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            resolved = []
+        keys = {
+            get_resolution_key(path, python_executable, environment_hash): path
+            for path in resolved
+        }
+        keys.pop(None, None)
+        if keys:
+            record_resolutions(keys)
 
+    for path, representative in representatives.items():
+        if path != representative:
+            status, detail = results[representative]
+            results[path] = (status, detail or f"same as '{representative}'")
 
-def parse_missing_module(stderr_output):
+    print_summary(installed_packages)
+    return results
+
+
+def dry_run_dependencies(script_paths, python_executable):
     """
-    Parses stderr output to find the name of the missing module.
-    It looks for standard 'No module named' or 'ImportError' messages.
+    Statically detects the missing imports of the scripts and prints what the
+    installer backend would install for them, without installing anything or
+    running the scripts. Returns whether the backend could satisfy them all.
     """
-    patterns = [
-        r"No module named '([^']*)'",
-        r"No module named \"([^\"]*)\"",
-        r"ImportError: No module named (\S+)",
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, stderr_output)
-        if match:
-            return match.group(1)
-    return None
+    scans = {}
+    for script_path in script_paths:
+        try:
+            scans[script_path] = scan_imports(script_path)
+        except (OSError, SyntaxError, ValueError) as e:
+            logging.warning(f"Static import scan of '{script_path}' failed: {e}")
+    missing_modules = find_missing_imports(scans, python_executable)
+    if not missing_modules:
+        logging.info("No missing modules detected.")
+        return True
 
+    logging.info(f"Statically detected missing modules: {sorted(missing_modules)}")
+    groups = {}
+    for module_name in sorted(missing_modules):
+        pip_args, cwd = get_pip_args(module_name)
+        groups.setdefault(cwd, []).extend(pip_args)
 
-aliases = load_aliases()
+    backend = get_installer_backend()
+    all_succeeded = True
+    for cwd, pip_args in groups.items():
+        success, output = backend.dry_run(
+            list(dict.fromkeys(pip_args)), python_executable, cwd
+        )
+        print(output)
+        all_succeeded = all_succeeded and success
+    return all_succeeded
 
 
-def install_package(package_name, python_executable, assume_yes=False):
+def print_batch_results(results):
     """
-    Installs a given package using pip into the specified python environment.
-    Prompts the user for confirmation unless assume_yes is True.
+    Prints one line per script with the outcome of a batch resolution.
     """
-    if not package_name:
-        return False, "No package name provided."
+    print("\n--- Per-Script Results ---")
+    for path in sorted(results):
+        status, detail = results[path]
+        print(f"  [{status}] {path}" + (f" - {detail}" if detail else ""))
+    print("---------------------------------------")
 
-    if not assume_yes:
-        try:
-            prompt = input(
-                f"Missing package '{package_name}'. Install with pip? [Y/n] "
-            )
-            if prompt.lower().strip() not in ["", "y", "yes"]:
-                logging.warning(f"Skipping installation of '{package_name}'.")
-                return False, f"User declined to install {package_name}."
-        except KeyboardInterrupt:
-            logging.info("\nInstallation cancelled by user.")
-            sys.exit(1)
 
-    logging.info(f"Attempting to install '{package_name}' with pip...")
-    alias = aliases.get(package_name, {"package_name": package_name, "cwd": None})
-    if alias["package_name"] == ".":
-        pkg = ["-e", "."]
-    else:
-        pkg = [alias["package_name"]]
+def get_venv_python(env_path) -> str:
+    """
+    Returns the path of the python executable inside a virtual environment.
+    """
+    if sys.platform == "win32":
+        return os.path.join(env_path, "Scripts", "python.exe")
+    return os.path.join(env_path, "bin", "python")
 
+
+def run_venv_module(env_path):
+    """
+    Creates a virtual environment with 'python -m venv' using the interpreter
+    running this script. Returns a (success, message) tuple.
+    """
     try:
-        # Running pip as a module of the potentially virtualized python
-        install_process = subprocess.run(
-            [python_executable, "-m", "pip", "install"] + pkg,
+        subprocess.run(
+            [sys.executable, "-m", "venv", env_path],
             check=True,
             capture_output=True,
             text=True,
-            cwd=alias.get("cwd"),
         )
-        logging.info(f"Successfully installed '{package_name}'.")
-        print(install_process.stdout)
-        return True, ""
+        return True, "Successfully created virtual environment."
     except subprocess.CalledProcessError as e:
-        error_message = f"Failed to install '{package_name}'.\n"
-        error_message += f"pip exited with status {e.returncode}.\n"
-        error_message += f"Stderr:\n{e.stderr}"
-        return False, error_message
-    except FileNotFoundError:
-        error_message = f"Error: '{python_executable}' command not found. Is Python installed and in your PATH?"
-        return False, error_message
+        return False, f"Failed to create virtual environment.\n{e.stderr}"
+
 
+# Written into a template once it is complete, so half-built ones are rebuilt
+VENV_TEMPLATE_MARKER = ".dependency_guesser_template"
 
-def resolve_dependencies(script_path, timeout, assume_yes, python_executable):
+
+def get_venv_template_dir() -> str:
     """
-    Main loop to run the script, catch import errors, and install dependencies.
+    Returns the directory of the pristine venv template for this interpreter.
     """
-    installed_packages = []
-    max_retries = 20  # A safe limit to prevent infinite loops
-    retries = 0
+    return os.path.join(get_cache_dir(), "templates", get_interpreter_tag())
 
-    while retries < max_retries:
-        retries += 1
-        logging.info(
-            f"--- Attempt {retries}: Running '{script_path}' using '{python_executable}' ---"
-        )
+
+def ensure_venv_template():
+    """
+    Returns the venv template directory, creating the template with venv the
+    first time. Returns None if it cannot be created.
+    """
+    template_dir = get_venv_template_dir()
+    marker = os.path.join(template_dir, VENV_TEMPLATE_MARKER)
+    if os.path.exists(marker):
+        return template_dir
+
+    with EnvironmentLock(template_dir, exclusive=True):
+        if os.path.exists(marker):
+            return template_dir
+        logging.info(f"Creating venv template '{template_dir}'...")
+        shutil.rmtree(template_dir, ignore_errors=True)
+        success, message = run_venv_module(template_dir)
+        if not success:
+            logging.warning(f"Could not create the venv template: {message}")
+            return None
+        with open(marker, "w"):
+            pass
+    return template_dir
+
+
+def copy_file(source, destination):
+    """
+    Copies a file, letting the kernel share its blocks (a reflink on
+    copy-on-write filesystems) through copy_file_range where available.
+    """
+    if hasattr(os, "copy_file_range"):
         try:
-            # Execute the target script as a subprocess using the correct interpreter
-            process = subprocess.run(
-                [python_executable, script_path],
-                capture_output=True,
-                text=True,
-                timeout=timeout,
-            )
+            with open(source, "rb") as src, open(destination, "wb") as dst:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            shutil.copystat(source, destination)
+            return
+        except OSError:
+            pass  # e.g. unsupported by the filesystem; copy the regular way
+    shutil.copy2(source, destination)
 
-            # Check stderr for import errors
-            stderr_output = process.stderr
-            if process.returncode != 0 and stderr_output:
-                missing_module = parse_missing_module(stderr_output)
-                if missing_module:
-                    logging.info(f"Detected missing module: '{missing_module}'")
 
-                    package_to_install = missing_module
+def clone_file(source, destination):
+    """
+    Hardlinks a file, copying it instead when linking is not possible.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        copy_file(source, destination)
 
-                    success, message = install_package(
-                        package_to_install, python_executable, assume_yes
-                    )
-                    if success:
-                        installed_packages.append(package_to_install)
-                        continue
-                    else:
-                        logging.error(f"Error: {message}")
-                        logging.critical("Aborting due to installation failure.")
-                        sys.exit(1)
+
+def clone_venv(template_dir, env_path):
+    """
+    Clones a venv template into env_path, which must not exist yet.
+    Files are hardlinked, except the ones referring to the template's own path
+    (pyvenv.cfg and the scripts in bin/Scripts), which are rewritten to point
+    at the clone. Symlinks are recreated. pip replaces files rather than
+    writing into them, so installs into the clone leave the template intact.
+    """
+    old_path = os.fsencode(template_dir)
+    new_path = os.fsencode(env_path)
+    os.makedirs(env_path)
+    for root, dirs, files in os.walk(template_dir):
+        relative_root = os.path.relpath(root, template_dir)
+        target_root = os.path.normpath(os.path.join(env_path, relative_root))
+        rewrite = relative_root in (".", "bin", "Scripts")
+        for name in dirs + files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(source):
+                link = os.readlink(source)
+                if link.startswith(template_dir):
+                    link = env_path + link[len(template_dir) :]
+                os.symlink(link, target)
+            elif name in dirs:
+                os.mkdir(target)
+            elif relative_root == "." and name == VENV_TEMPLATE_MARKER:
+                continue
+            elif rewrite and not name.endswith(".exe"):
+                with open(source, "rb") as f:
+                    data = f.read()
+                if old_path in data:
+                    with open(target, "wb") as f:
+                        f.write(data.replace(old_path, new_path))
+                    shutil.copymode(source, target)
                 else:
-                    logging.error(
-                        "Script failed with an error that is not a recognized import error."
-                    )
-                    logging.error(f"Return Code: {process.returncode}")
-                    print(f"\n--- STDOUT ---\n{process.stdout}")
-                    print(f"\n--- STDERR ---\n{stderr_output}")
-                    break
+                    clone_file(source, target)
             else:
-                logging.info("--- Script Execution Successful ---")
-                logging.info("The script ran without any import errors.")
-                print(f"\n--- STDOUT ---\n{process.stdout}")
-                if process.stderr:
-                    print(f"\n--- STDERR ---\n{process.stderr}")
-                break
+                clone_file(source, target)
+
+
+def create_virtual_environment(env_path):
+    """
+    Creates a virtual environment by cloning the template for this interpreter,
+    falling back to venv when there is no usable template.
+    Returns a (success, message) tuple.
+    """
+    logging.info(f"Creating virtual environment '{env_path}'...")
+    env_path = os.path.abspath(env_path)
+    template_dir = ensure_venv_template()
+    if template_dir and not os.path.exists(env_path):
+        start = time.monotonic()
+        try:
+            with EnvironmentLock(template_dir):
+                clone_venv(template_dir, env_path)
+            elapsed_ms = (time.monotonic() - start) * 1000
+            return True, f"Cloned virtual environment template in {elapsed_ms:.0f}ms."
+        except OSError as e:
+            logging.warning(f"Could not clone the venv template: {e}")
+            shutil.rmtree(env_path, ignore_errors=True)
+    return run_venv_module(env_path)
 
-        except FileNotFoundError:
-            logging.critical(
-                f"Error: The script '{script_path}' or interpreter '{python_executable}' was not found."
-            )
-            sys.exit(1)
-        except subprocess.TimeoutExpired:
-            logging.warning("--- Script Execution Timed Out ---")
-            logging.warning(
-                f"The script ran for more than the specified timeout of {timeout} seconds without exiting."
-            )
-            logging.info("Assuming all dependencies are resolved.")
-            break
-        except Exception as e:
-            logging.critical(f"An unexpected error occurred: {e}")
-            sys.exit(1)
 
-    if retries >= max_retries:
-        logging.critical(
-            "Reached maximum number of retries. Aborting to prevent infinite loop."
+# .pth file in an overlay environment that puts its base layer on sys.path
+BASE_LAYER_PTH = "dependency_guesser_base.pth"
+
+
+def link_base_environment(env_path, base_env_path):
+    """
+    Layers the environment at env_path over a shared, read-only base environment.
+    A .pth file in the overlay's site-packages adds the base's site-packages
+    (including their own .pth files) after the overlay's, so pip only installs
+    what the base does not already provide, and into the overlay.
+    Returns a (success, message) tuple.
+    """
+    base_python = get_venv_python(base_env_path)
+    if not os.path.exists(base_python):
+        return (
+            False,
+            f"No Python executable found in base environment '{base_env_path}'.",
+        )
+    try:
+        base_info = get_interpreter_snapshot(base_python)
+        info = get_interpreter_snapshot(get_venv_python(env_path))
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        return False, f"Could not inspect the environments: {e}"
+    base_version, version = tuple(base_info["version"]), tuple(info["version"])
+    if base_version != version:
+        return False, (
+            f"Base environment '{base_env_path}' uses Python {'.'.join(map(str, base_version))}, "
+            f"but '{env_path}' uses Python {'.'.join(map(str, version))}."
         )
 
-    print("\n--- Dependency Resolution Summary ---")
-    if installed_packages:
-        print("Successfully installed the following packages:")
-        for pkg in installed_packages:
-            print(f"  - {pkg}")
-    else:
-        print("No new packages needed to be installed.")
-    print("---------------------------------------")
+    lines = [
+        f"import site; site.addsitedir({path!r})\n"
+        for path in base_info["site_packages"]
+    ]
+    with open(os.path.join(info["site_packages"][0], BASE_LAYER_PTH), "w") as f:
+        f.writelines(lines)
+    return True, f"Layered '{env_path}' over base environment '{base_env_path}'."
+
+
+# Distributions every new venv starts with; they do not count as requirements
+VENV_SEED_DISTRIBUTIONS = {"pip", "setuptools"}
+
+DEFAULT_POOL_MAX_SIZE = 10 * 1024  # megabytes
+DEFAULT_POOL_MAX_ENTRIES = 20
+
+
+def get_pool_dir() -> str:
+    """
+    Returns the directory holding the pooled environments and their index.
+    """
+    return os.path.join(get_cache_dir(), "envs")
+
+
+def get_pool_index_file() -> str:
+    """
+    Returns the path of the index describing every pooled environment.
+    """
+    return os.path.join(get_pool_dir(), "index.json")
+
+
+def load_pool_index() -> dict:
+    """
+    Loads the pool index, returning an empty one if it is missing or corrupt.
+    The caller is expected to hold the pool lock.
+    """
+    try:
+        with open(get_pool_index_file(), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_pool_index(index):
+    """
+    Atomically replaces the pool index. The caller is expected to hold the pool lock.
+    """
+    write_json_atomic(get_pool_index_file(), index, indent=2)
+
+
+def get_interpreter_tag() -> str:
+    """
+    Identifies the interpreter pooled environments and venv templates are
+    created with. Installs of the same version (say pyenv's and the system's)
+    differ in the paths their environments point at, so the tag includes the
+    resolved path of the interpreter.
+    """
+    version = ".".join(str(part) for part in sys.version_info[:3])
+    executable = os.path.realpath(sys.executable)
+    digest = hashlib.sha256(executable.encode()).hexdigest()[:8]
+    return f"{sys.implementation.name}-{version}-{digest}"
+
+
+def get_requirements_key(interpreter_tag, requirements) -> str:
+    """
+    Hashes an interpreter and a requirement set into the key of a pooled environment.
+    """
+    payload = json.dumps([interpreter_tag, sorted(requirements)])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def get_requirement_name(requirement) -> str:
+    """
+    Returns the normalized distribution name of a requirement such as 'name==1.0'.
+    """
+    return normalize_distribution_name(re.split(r"[<>=!~\[;@ ]", requirement)[0])
+
+
+def estimate_requirements(script_paths):
+    """
+    Statically estimates the distributions the scripts need, by mapping their
+    third-party imports the same way missing modules are installed.
+    """
+    stdlib_modules = set(getattr(sys, "stdlib_module_names", ())) | set(
+        sys.builtin_module_names
+    )
+    requirements = set()
+    for script_path in script_paths:
+        script_dir = os.path.dirname(os.path.abspath(script_path))
+        for module_name in scan_imports_or_empty(script_path):
+            if module_name in stdlib_modules:
+                continue
+            if find_local_module_files(script_path, module_name, 0, script_dir):
+                continue
+            pip_args, _ = get_pip_args(module_name)
+            if pip_args[0] != "-e":
+                requirements.add(get_requirement_name(pip_args[0]))
+    return requirements
+
+
+def find_pool_entry(index, interpreter_tag, requirements):
+    """
+    Returns the id of the smallest pooled environment providing every requirement,
+    or None. Among equally small ones the most recently used wins.
+    """
+    candidates = []
+    for entry_id, entry in index.items():
+        if entry["interpreter"] != interpreter_tag:
+            continue
+        provided = {get_requirement_name(r) for r in entry["requirements"]}
+        if requirements <= provided:
+            candidates.append((len(provided), -entry["last_used"], entry_id))
+    return min(candidates)[2] if candidates else None
+
+
+# In-use locks of the pooled environments this process holds, by entry id
+pool_usage_locks = {}
+
+
+def get_pool_usage_lock(entry_id, exclusive=False):
+    """
+    Returns the lock marking a pooled environment as in use. Resolvers hold it
+    shared from acquiring the environment until releasing it, and eviction
+    needs it exclusively. It is separate from the environment's own lock,
+    which pip takes exclusively while the environment is in use.
+    """
+    return EnvironmentLock(
+        os.path.join(get_pool_dir(), f"{entry_id}.in-use"), exclusive=exclusive
+    )
+
+
+def acquire_pool_environment(script_paths):
+    """
+    Picks the pooled environment for the scripts, creating one if no entry
+    provides their estimated requirements. The environment is marked as in use
+    until release_pool_environment is called. Returns an (entry_id,
+    python_executable) tuple, or (None, error message) if the environment could
+    not be created.
+    """
+    os.makedirs(get_pool_dir(), exist_ok=True)
+    interpreter_tag = get_interpreter_tag()
+    requirements = estimate_requirements(script_paths)
+    logging.debug(f"Estimated requirements: {sorted(requirements)}")
+
+    with EnvironmentLock(get_pool_dir(), exclusive=True):
+        index = load_pool_index()
+        entry_id = find_pool_entry(index, interpreter_tag, requirements)
+        usage_lock = get_pool_usage_lock(entry_id) if entry_id else None
+        # Without shared locks (Windows) an environment in use cannot be shared
+        if usage_lock and usage_lock.acquire(blocking=False):
+            pool_usage_locks[entry_id] = usage_lock
+            index[entry_id]["last_used"] = time.time()
+            save_pool_index(index)
+            env_path = os.path.join(get_pool_dir(), entry_id)
+            logging.info(f"Reusing pooled environment '{env_path}'.")
+            return entry_id, get_venv_python(env_path)
+
+        entry_id = get_requirements_key(interpreter_tag, requirements)
+        suffix = 1
+        while entry_id in index or os.path.exists(
+            os.path.join(get_pool_dir(), entry_id)
+        ):
+            suffix += 1
+            entry_id = f"{get_requirements_key(interpreter_tag, requirements)}-{suffix}"
+        index[entry_id] = {
+            "key": get_requirements_key(interpreter_tag, []),
+            "interpreter": interpreter_tag,
+            "requirements": [],
+            "size": 0,
+            "last_used": time.time(),
+        }
+        save_pool_index(index)
+        # Taken before the pool lock is released, so nobody can use the entry
+        # before its environment exists
+        env_path = os.path.join(get_pool_dir(), entry_id)
+        env_lock = EnvironmentLock(env_path, exclusive=True)
+        env_lock.acquire()
+        usage_lock = get_pool_usage_lock(entry_id)
+        usage_lock.acquire()
+        pool_usage_locks[entry_id] = usage_lock
+
+    try:
+        success, message = create_virtual_environment(env_path)
+    finally:
+        env_lock.release()
+    if not success:
+        with EnvironmentLock(get_pool_dir(), exclusive=True):
+            index = load_pool_index()
+            index.pop(entry_id, None)
+            save_pool_index(index)
+        shutil.rmtree(env_path, ignore_errors=True)
+        pool_usage_locks.pop(entry_id).release()
+        return None, message
+    logging.info(message)
+    return entry_id, get_venv_python(env_path)
+
+
+def get_directory_size(path) -> int:
+    """
+    Returns the disk usage of a directory tree, counting hardlinked files once.
+    """
+    seen = set()
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+def evict_pool_environments(index, max_size, max_entries, keep=None):
+    """
+    Removes the least recently used environments from the index and disk until
+    the pool fits in max_size bytes and max_entries entries. Environments in use
+    by another resolver, and the one named keep, are skipped.
+    The caller is expected to hold the pool lock.
+    """
+    total_size = sum(entry["size"] for entry in index.values())
+    by_age = sorted(index, key=lambda entry_id: index[entry_id]["last_used"])
+    for entry_id in by_age:
+        if total_size <= max_size and len(index) <= max_entries:
+            break
+        if entry_id == keep:
+            continue
+        env_path = os.path.join(get_pool_dir(), entry_id)
+        usage_lock = get_pool_usage_lock(entry_id, exclusive=True)
+        if not usage_lock.acquire(blocking=False):
+            continue
+        try:
+            env_lock = EnvironmentLock(env_path, exclusive=True)
+            if not env_lock.acquire(blocking=False):
+                continue
+            try:
+                shutil.rmtree(env_path, ignore_errors=True)
+            finally:
+                env_lock.release()
+        finally:
+            usage_lock.release()
+        total_size -= index.pop(entry_id)["size"]
+        logging.info(f"Evicted pooled environment '{env_path}'.")
+
+
+def release_pool_environment(
+    entry_id,
+    python_executable,
+    max_size=DEFAULT_POOL_MAX_SIZE * 1024 * 1024,
+    max_entries=DEFAULT_POOL_MAX_ENTRIES,
+):
+    """
+    Records what a pooled environment holds after a resolution, re-keying it by
+    its installed requirement set, then evicts old entries if the pool is too big.
+    Finally marks the environment as no longer in use.
+    """
+    try:
+        update_pool_entry(entry_id, python_executable, max_size, max_entries)
+    finally:
+        usage_lock = pool_usage_locks.pop(entry_id, None)
+        if usage_lock:
+            usage_lock.release()
+
+
+def update_pool_entry(entry_id, python_executable, max_size, max_entries):
+    """
+    Re-keys a pooled environment by what it now holds and evicts old entries.
+    """
+    try:
+        with lock_environment(python_executable):
+            snapshot = get_interpreter_snapshot(python_executable)
+        requirements = [
+            requirement
+            for requirement in snapshot["distributions"]
+            if get_requirement_name(requirement) not in VENV_SEED_DISTRIBUTIONS
+        ]
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        logging.warning(f"Could not list the pooled environment's distributions: {e}")
+        requirements = None
+
+    env_path = os.path.join(get_pool_dir(), entry_id)
+    size = get_directory_size(env_path)
+    with EnvironmentLock(get_pool_dir(), exclusive=True):
+        index = load_pool_index()
+        entry = index.get(entry_id)
+        if entry is not None:
+            if requirements is not None:
+                entry["requirements"] = requirements
+                entry["key"] = get_requirements_key(entry["interpreter"], requirements)
+            entry["size"] = size
+            entry["last_used"] = time.time()
+        evict_pool_environments(index, max_size, max_entries, keep=entry_id)
+        save_pool_index(index)
 
 
 if __name__ == "__main__":
+    # Plugins may contribute the installer choices
+    load_installer_plugins()
     parser = argparse.ArgumentParser(
         description="Automatically detect and install missing Python packages for a script, with optional venv creation.",
         formatter_class=argparse.RawTextHelpFormatter,
     )
-    parser.add_argument("script_path", help="The path to the Python script to run.")
     parser.add_argument(
+        "script_path",
+        nargs="?",
+        help="The path to the Python script to run.\nA directory or glob pattern resolves every matching script in batch mode.",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="File listing scripts (paths or glob patterns, one per line) to resolve in batch mode.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of scripts scanned and verified in parallel in batch mode.\n(default: number of CPUs)",
+    )
+    env_group = parser.add_mutually_exclusive_group()
+    env_group.add_argument(
         "--create-env",
         action="store_true",
         help=f"Create a virtual environment named '{VENV_NAME}' and install dependencies there.",
     )
+    env_group.add_argument(
+        "--env-pool",
+        action="store_true",
+        help="Use a shared environment from the pool in the cache directory, reusing one\nthat already provides the script's requirements.",
+    )
+    parser.add_argument(
+        "--base-env",
+        help="Shared environment whose packages the environment made by --create-env\nuses without installing them again. It is never modified.",
+    )
+    parser.add_argument(
+        "--pool-max-size",
+        type=int,
+        default=DEFAULT_POOL_MAX_SIZE,
+        help=f"Size in megabytes above which the least recently used pooled environments\nare evicted. (default: {DEFAULT_POOL_MAX_SIZE})",
+    )
+    parser.add_argument(
+        "--pool-max-entries",
+        type=int,
+        default=DEFAULT_POOL_MAX_ENTRIES,
+        help=f"Number of pooled environments kept. (default: {DEFAULT_POOL_MAX_ENTRIES})",
+    )
     parser.add_argument(
         "--fork-timeout",
         type=int,
         default=15,
         help="Time in seconds to wait for the script to execute before timing out.\n(default: 15)",
     )
+    parser.add_argument(
+        "--import-idle-ms",
+        type=int,
+        default=0,
+        help="Stop the script once it has run past its top-level imports and imported nothing\nnew for this many milliseconds, instead of waiting for it to exit or time out.\nImports done later are not checked. 0 disables this. (default: 0)",
+    )
+    parser.add_argument(
+        "--capture-limit",
+        type=int,
+        default=DEFAULT_CAPTURE_LIMIT,
+        help=f"Bytes of the script's stdout and stderr kept in memory (the tail).\n(default: {DEFAULT_CAPTURE_LIMIT})",
+    )
+    parser.add_argument(
+        "--output-log",
+        help="Append the script's complete output from every run to this file.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always run the script, even if it was already resolved in this unchanged environment.",
+    )
+    parser.add_argument(
+        "--installer",
+        default=installer_backend,
+        choices=sorted(INSTALLER_BACKENDS),
+        help=f"Installer backend. 'wheel-store' hardlinks wheels from a content-addressed\nstore in the cache directory, building them with 'pip wheel' the first time.\n'pip-worker' keeps one pip process per environment alive between installs.\n(default: {installer_backend})",
+    )
+    parser.add_argument(
+        "--wheelhouse",
+        help="Offline mode: install only from the wheels and sdists in this directory,\nwithout contacting any package index.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print what would be installed for the statically detected missing\nimports, without installing anything or running the script.",
+    )
     parser.add_argument(
         "-y",
         "--yes",
         action="store_true",
         help="Automatically answer 'yes' to all installation prompts.",
     )
+    parser.add_argument(
+        "--no-prescan",
+        action="store_true",
+        help="Skip the static import scan and discover missing modules only by running the script.",
+    )
+    parser.add_argument(
+        "--probe",
+        action="store_true",
+        help="Run the script once with stubbed imports to collect every missing module\nbefore the regular runs. Imports the script guards itself are collected too.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Download the distributions of statically detected missing imports in the\nbackground while the probe (--probe) or the first run (--no-prescan) executes,\nso installing them only unpacks local files. Requires one of those options.",
+    )
     parser.add_argument(
         "--log-level",
         default="INFO",
@@ -225,6 +4061,17 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    if not args.script_path and not args.manifest:
+        parser.error("a script path or --manifest is required")
+    if args.base_env and not args.create_env:
+        parser.error("--base-env requires --create-env")
+    if args.wheelhouse and not os.path.isdir(args.wheelhouse):
+        parser.error(f"wheelhouse '{args.wheelhouse}' is not a directory")
+    if args.prefetch and not (args.probe or args.no_prescan):
+        # The pre-scan installs right away, leaving nothing to overlap with
+        parser.error("--prefetch requires --probe or --no-prescan")
+    if args.capture_limit <= 0:
+        parser.error("--capture-limit must be a positive number of bytes")
 
     logging.basicConfig(
         level=args.log_level,
@@ -233,31 +4080,46 @@ if __name__ == "__main__":
     )
 
     python_executable = sys.executable
+    installer_backend = args.installer
+    wheelhouse_dir = args.wheelhouse
+    batch_mode = bool(
+        args.manifest
+        or os.path.isdir(args.script_path)
+        or any(char in args.script_path for char in GLOB_CHARACTERS)
+    )
+    if batch_mode:
+        # Runs happen concurrently and installs up front, so these do not apply
+        if args.output_log:
+            parser.error("--output-log cannot be used in batch mode")
+        if args.prefetch:
+            parser.error("--prefetch cannot be used in batch mode")
+        script_paths = expand_script_paths(args.script_path, args.manifest)
+    else:
+        script_paths = [args.script_path]
+    pool_entry = None
 
     if args.create_env:
-        if os.path.exists(VENV_NAME):
-            logging.warning(
-                f"Directory '{VENV_NAME}' already exists. Using existing environment."
-            )
-        else:
-            logging.info(f"Creating virtual environment '{VENV_NAME}'...")
-            try:
-                subprocess.run(
-                    [sys.executable, "-m", "venv", VENV_NAME],
-                    check=True,
-                    capture_output=True,
-                    text=True,
+        # Another resolver may be creating the same environment right now
+        with EnvironmentLock(VENV_NAME, exclusive=True):
+            if os.path.exists(VENV_NAME):
+                logging.warning(
+                    f"Directory '{VENV_NAME}' already exists. Using existing environment."
                 )
-                logging.info("Successfully created virtual environment.")
-            except subprocess.CalledProcessError as e:
-                logging.critical(f"Failed to create virtual environment.\n{e.stderr}")
-                sys.exit(1)
+            else:
+                success, message = create_virtual_environment(VENV_NAME)
+                if not success:
+                    logging.critical(message)
+                    sys.exit(1)
+                logging.info(message)
+            if args.base_env:
+                success, message = link_base_environment(VENV_NAME, args.base_env)
+                if not success:
+                    logging.critical(message)
+                    sys.exit(1)
+                logging.info(message)
 
         # Determine the path to the python executable in the venv
-        if sys.platform == "win32":
-            python_executable = os.path.join(VENV_NAME, "Scripts", "python.exe")
-        else:
-            python_executable = os.path.join(VENV_NAME, "bin", "python")
+        python_executable = get_venv_python(VENV_NAME)
 
         if not os.path.exists(python_executable):
             logging.critical(
@@ -265,8 +4127,55 @@ if __name__ == "__main__":
             )
             sys.exit(1)
 
+        # Some helper processes run from the script's directory, not from here
+        python_executable = os.path.abspath(python_executable)
         logging.info(f"Using Python interpreter from venv: '{python_executable}'")
+    elif args.env_pool:
+        pool_entry, python_executable = acquire_pool_environment(script_paths)
+        if pool_entry is None:
+            logging.critical(python_executable)
+            sys.exit(1)
+        logging.info(f"Using Python interpreter from pool: '{python_executable}'")
 
-    resolve_dependencies(
-        args.script_path, args.fork_timeout, args.yes, python_executable
-    )
+    try:
+        if args.dry_run:
+            sys.exit(0 if dry_run_dependencies(script_paths, python_executable) else 1)
+
+        if batch_mode:
+            results = resolve_batch(
+                script_paths,
+                args.fork_timeout,
+                args.yes,
+                python_executable,
+                jobs=args.jobs,
+                prescan=not args.no_prescan,
+                probe=args.probe,
+                import_idle_ms=args.import_idle_ms,
+                capture_limit=args.capture_limit,
+                use_cache=not args.no_cache,
+            )
+            print_batch_results(results)
+            ok_statuses = ("resolved", "cached")
+            sys.exit(0 if all(r[0] in ok_statuses for r in results.values()) else 1)
+
+        resolve_dependencies(
+            args.script_path,
+            args.fork_timeout,
+            args.yes,
+            python_executable,
+            prescan=not args.no_prescan,
+            probe=args.probe,
+            import_idle_ms=args.import_idle_ms,
+            capture_limit=args.capture_limit,
+            output_log=args.output_log,
+            use_cache=not args.no_cache,
+            prefetch=args.prefetch and not args.wheelhouse,
+        )
+    finally:
+        if pool_entry:
+            release_pool_environment(
+                pool_entry,
+                python_executable,
+                max_size=args.pool_max_size * 1024 * 1024,
+                max_entries=args.pool_max_entries,
+            )